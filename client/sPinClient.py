@@ -10,9 +10,17 @@
 # socket: to connect to a peer
 # uuid: to uniquely identify copies of a file across time
 # os: to get size of file for sending file as a message using TCP
+# asyncio/aiohttp: for the async client, which fans out to peers concurrently
+# threading: to refresh the cached peer list in the background
+# concurrent.futures/io: to fetch the chunks of a chunked object in parallel, and upload its manifest from memory
+# collections: to queue up the parts of a ranged download
+# shutil: to copy objects out of the local cache when they can't be hardlinked
 
 import http.client
 import requests # for multipart mainly, but using for all now
+import requests.adapters
+import asyncio
+import aiohttp
 import json
 import random
 import time
@@ -22,6 +30,11 @@ import math
 import os
 import hashlib
 import sys
+import threading
+import collections
+import concurrent.futures
+import io
+import shutil
 
 
 # CATALOG_SERVER: address and port of name server
@@ -31,21 +44,438 @@ import sys
 CATALOG_SERVER = 'catalog.cse.nd.edu:9097'
 ENTRY_TYPE = 'sPin'
 CLIENT_STALENESS = 60 # client should assume nameserver record is stale if older than 1m
+PEER_CACHE_TTL = CLIENT_STALENESS // 4 # cached peer list is refreshed in the background once older than this, and not used at all past CLIENT_STALENESS
 RETRIES = 3 # retry 3x for things like not being able to hear from the catalog server, etc
 K_DENOM = 3 # denominator for determining k
+ASYNC_CONN_LIMIT = 100 # max simultaneous connections held open by the async client
+POOL_SIZE = 10 # keep-alive connections the sync client holds per peer
+POOL_IDLE_TIMEOUT = 5 * CLIENT_STALENESS # close a peer's connections after they've gone unused this long
+
+# chunked objects
+# a chunked object is stored as a manifest listing its chunks, and each chunk is stored once per peer however many objects share it
+# chunk boundaries come from a rolling hash of the content, so an edit only changes the chunks around it
+CHUNK_MIN = 256 * 1024 # no boundary is looked for in the first CHUNK_MIN bytes of a chunk
+CHUNK_AVG_BITS = 20 # past CHUNK_MIN, a boundary turns up every 2 ** CHUNK_AVG_BITS bytes on average
+CHUNK_MAX = 4 * 1024 * 1024 # chunks are cut here if no boundary turned up
+CHUNK_WORKERS = 4 # chunks fetched at once when reassembling
+MANIFEST_MAGIC = b'spin-manifest\n' # must match the server's
+
+# ranged downloads
+RANGE_PART_SIZE = 4 * 1024 * 1024 # bytes asked of a peer at a time
+RANGE_READ_SIZE = 64 * 1024
+RANGE_TIMEOUT = 10 # seconds to wait on a peer before giving its part to another
+
+# resumable uploads
+UPLOAD_SESSION_MIN = 16 * 1024 * 1024 # files at least this big are uploaded through a session that can pick up where it left off
+
+# local cache
+LOCAL_CACHE_SIZE = 1_000_000_000 # bytes of downloaded objects kept in the local cache directory, if there is one
+
+# gear table for the rolling hash, fixed so every client cuts the same content in the same places
+CHUNK_GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'big') for i in range(256)]
+CHUNK_MASK = ((1 << CHUNK_AVG_BITS) - 1) << (64 - CHUNK_AVG_BITS) # high bits, which depend on the most bytes
+
+# pull live sPin peers out of a nameserver catalog
+def parse_catalog(catalog):
+
+    # get peers from catalog
+    now = time.time()
+    all_peers = [entry for entry in catalog if entry.get('type', '') == ENTRY_TYPE and (now - entry.get('lastheardfrom') < CLIENT_STALENESS)]
+
+    # deduplicate the peers, keeping only the latest entry for a uuid
+    duplicates = {}
+    for peer in all_peers:
+        if peer['uuid'] in duplicates:
+            duplicates[peer['uuid']].append(peer)
+        else:
+            duplicates[peer['uuid']] = [peer]
+    peers = [max(dupes, key=lambda k: k['lastheardfrom']) for dupes in duplicates.values()]
+
+    return peers
+
+# hexdigest of a file, raises FileNotFoundError if it isn't there
+def file_digest(filepath):
+
+    hash = hashlib.sha256()
+
+    with open(filepath, 'rb') as to_hash:
+        while True:
+            chunk = to_hash.read(hash.block_size)
+            if not chunk:
+                break
+            hash.update(chunk)
+
+    return hash.hexdigest()
+
+# length of the first chunk in data, data being at least CHUNK_MAX bytes unless it's the end of the file
+def find_cut(data):
+
+    limit = min(len(data), CHUNK_MAX)
+    if limit <= CHUNK_MIN:
+        return limit
+
+    hash = 0
+    for i in range(CHUNK_MIN, limit):
+        hash = ((hash << 1) + CHUNK_GEAR[data[i]]) & 0xFFFFFFFFFFFFFFFF
+        if not hash & CHUNK_MASK:
+            return i + 1
+
+    return limit
+
+# split a file into content defined chunks
+# returns the manifest for it and a list of (offset, size, hash) for each chunk
+def make_manifest(filepath):
+
+    chunks = []
+    whole = hashlib.sha256()
+    offset = 0
+
+    with open(filepath, 'rb') as to_chunk:
+        buffer = b''
+        eof = False
+        while True:
+
+            # keep at least a full chunk buffered so the cut isn't made short
+            if not eof and len(buffer) < CHUNK_MAX:
+                more = to_chunk.read(4 * CHUNK_MAX)
+                eof = not more
+                buffer += more
+                continue
+            if not buffer:
+                break
+
+            cut = find_cut(buffer)
+            chunk = buffer[:cut]
+            buffer = buffer[cut:]
+
+            whole.update(chunk)
+            chunks.append((offset, cut, hashlib.sha256(chunk).hexdigest()))
+            offset += cut
+
+    manifest = {'size': offset, 'hash': whole.hexdigest(), 'chunks': [[hash, size] for _, size, hash in chunks]}
+    return MANIFEST_MAGIC + json.dumps(manifest).encode(), chunks
+
+# the manifest in a file, or None if it isn't one
+def read_manifest(filepath):
+
+    with open(filepath, 'rb') as file:
+        if file.read(len(MANIFEST_MAGIC)) != MANIFEST_MAGIC:
+            return None
+        try:
+            return json.loads(file.read())
+        except ValueError:
+            return None
+
+# parts of a ranged download, shared between the peers it's coming from
+# peers take parts from one queue, so a fast peer ends up doing more of them than a slow one,
+# and once the queue is empty an idle peer races the oldest part still in progress, so one slow peer can't hold up the end
+class RangeWork:
+    def __init__(self, size, part_size):
+        self.lock = threading.Lock()
+        self.pending = collections.deque((start, min(start + part_size, size) - 1) for start in range(0, size, part_size))
+        self.total = len(self.pending)
+        self.started = {} # part -> when it was first handed out
+        self.fetching = collections.Counter() # part -> peers fetching it right now
+        self.done = set()
+
+    # next part for a peer to fetch, or None if there's nothing it can help with
+    def next(self):
+        with self.lock:
+            if self.pending:
+                part = self.pending.popleft()
+            else:
+                racing = [part for part in self.started if part not in self.done and self.fetching[part] == 1]
+                if not racing:
+                    return None
+                part = min(racing, key=self.started.get)
+
+            self.started.setdefault(part, time.monotonic())
+            self.fetching[part] += 1
+            return part
+
+    # a peer finished with a part, putting it back in the queue if that failed and nobody else has it
+    def finish(self, part, ok):
+        with self.lock:
+            self.fetching[part] -= 1
+            if ok:
+                self.done.add(part)
+            elif part not in self.done and not self.fetching[part]:
+                del self.started[part]
+                self.pending.appendleft(part)
+
+    def is_done(self, part):
+        return part in self.done
+
+    def complete(self):
+        return len(self.done) == self.total
+
+# put a copy of source at destination, by hardlink where the filesystem allows it
+def link_or_copy(source, destination):
+
+    temp_location = f'{destination}.{uuid.uuid4().hex}'
+    try:
+        try:
+            os.link(source, temp_location)
+        except OSError:
+            shutil.copyfile(source, temp_location)
+        os.replace(temp_location, destination)
+    finally:
+        # replace leaves temp_location alone if destination was already a link to the same file
+        if os.path.lexists(temp_location):
+            os.unlink(temp_location)
+
+# content addressed cache of what this machine has downloaded, one file per hash in a directory
+# entries are least recently used first, going by access time so the order survives between runs,
+# and the oldest are removed once they add up to more than capacity bytes
+# files are hardlinked in and out where possible, so an entry is dropped if its size or mtime has changed,
+# which is what happens if a linked copy of it is written to
+class LocalCache:
+    def __init__(self, directory, capacity):
+        self.directory = directory
+        self.capacity = capacity # bytes
+        self.lock = threading.Lock()
+
+        # hash -> [size, mtime], least recently used first
+        self.entries = {}
+        self.size = 0
+
+        os.makedirs(directory, exist_ok=True)
+        found = []
+        for entry in os.scandir(directory):
+            if not entry.is_file() or len(entry.name) != 64: # not ours, or left behind by a put that didn't finish
+                continue
+            stat = entry.stat()
+            found.append((stat.st_atime_ns, entry.name, stat.st_size, stat.st_mtime_ns))
+
+        with self.lock:
+            for _, hash, size, mtime in sorted(found):
+                self.entries[hash] = [size, mtime]
+                self.size += size
+            self.trim()
+
+    def location(self, hash):
+        return os.path.join(self.directory, hash)
+
+    # whether hash is held, with its file as it was when it was put there
+    def has(self, hash):
+
+        with self.lock:
+            entry = self.entries.get(hash)
+            if entry is None:
+                return False
+            try:
+                stat = os.stat(self.location(hash))
+                if [stat.st_size, stat.st_mtime_ns] == entry:
+                    return True
+            except OSError:
+                pass
+            self.remove(hash)
+            return False
+
+    # put a copy of hash at filepath, returning whether it could
+    def copy(self, hash, filepath):
+
+        if not self.has(hash):
+            return False
+
+        location = self.location(hash)
+        try:
+            link_or_copy(location, filepath)
+        except OSError:
+            return False
+
+        # mark it used, leaving its mtime alone
+        with self.lock:
+            entry = self.entries.pop(hash, None)
+            if entry is not None:
+                self.entries[hash] = entry
+                try:
+                    os.utime(location, ns=(time.time_ns(), entry[1]))
+                except OSError:
+                    pass
+        return True
+
+    # keep the file at filepath as hash, which the caller has checked it is
+    def put_file(self, hash, filepath):
+        return self.put(hash, os.path.getsize(filepath), lambda location: link_or_copy(filepath, location))
+
+    # keep data as hash, which the caller has checked it is
+    def put_data(self, hash, data):
+
+        def write(location):
+            temp_location = f'{location}.{uuid.uuid4().hex}'
+            with open(temp_location, 'wb') as file:
+                file.write(data)
+            os.replace(temp_location, location)
+
+        return self.put(hash, len(data), write)
+
+    # add an entry for hash, with place putting its content at the location given to it
+    def put(self, hash, size, place):
+
+        if size > self.capacity:
+            return False
+        if self.has(hash):
+            return True
+
+        location = self.location(hash)
+        try:
+            place(location)
+            stat = os.stat(location)
+        except OSError:
+            return False
+
+        with self.lock:
+            self.remove(hash)
+            self.entries[hash] = [stat.st_size, stat.st_mtime_ns]
+            self.size += stat.st_size
+            self.trim()
+        return True
+
+    # remove least recently used entries until the cache fits, with the lock held
+    def trim(self):
+        while self.size > self.capacity:
+            self.remove(next(iter(self.entries)))
+
+    # forget hash and remove its file, with the lock held
+    def remove(self, hash):
+        entry = self.entries.pop(hash, None)
+        if entry is not None:
+            self.size -= entry[0]
+            try:
+                os.unlink(self.location(hash))
+            except OSError:
+                pass
 
 class sPinClient:
-    def __init__(self, verbose=False):
+    def __init__(self, verbose=False, pool_size=POOL_SIZE, pool_idle_timeout=POOL_IDLE_TIMEOUT, cache_dir=None, cache_size=LOCAL_CACHE_SIZE):
         self.verbose = verbose
-        
+
+        # objects already downloaded, so getting them again doesn't mean downloading them again
+        self.local = LocalCache(cache_dir, cache_size) if cache_dir else None
+
+        # keep-alive sessions, one per host:port, shared by all threads using this client
+        # records look like: host:port -> [session, last used]
+        self.pool_size = pool_size
+        self.pool_idle_timeout = pool_idle_timeout
+        self.sessions = {}
+        self.session_lock = threading.Lock()
+
+        # cached peer list, shared by all threads using this client
+        self.peer_cache = None
+        self.peer_cache_time = 0
+        self.peer_lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.refreshing = False
+
+    # get the keep-alive session for a host, making it if needed
+    def get_session(self, host):
+
+        now = time.time()
+
+        with self.session_lock:
+            # evict anything that's sat idle too long
+            for idle_host in [key for key, (_, last_used) in self.sessions.items() if now - last_used > self.pool_idle_timeout]:
+                self.sessions.pop(idle_host)[0].close()
+
+            if host not in self.sessions:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                self.sessions[host] = [session, now]
+
+            self.sessions[host][1] = now
+            return self.sessions[host][0]
+
+    # throw away a host's connections
+    def close_session(self, host):
+
+        with self.session_lock:
+            if host in self.sessions:
+                self.sessions.pop(host)[0].close()
+
+    # close all held connections
+    def close(self):
+
+        with self.session_lock:
+            for session, _ in self.sessions.values():
+                session.close()
+            self.sessions = {}
+
+    # get peers, from the cache when possible
     def get_peers(self):
 
+        with self.peer_lock:
+            peers, age = self.peer_cache, time.time() - self.peer_cache_time
+
+        # fresh enough to use as is
+        if peers and age < PEER_CACHE_TTL:
+            return list(peers)
+
+        # stale but still usable, hand it out while the nameserver is asked again in the background
+        if peers and age < CLIENT_STALENESS:
+            self.refresh_peers_background()
+            return list(peers)
+
+        # nothing usable, have to wait on the nameserver
+        return self.refresh_peers()
+
+    # ask the nameserver for peers and store the result in the cache
+    def refresh_peers(self):
+
+        # only one thread goes to the nameserver at a time, the rest use what it got
+        with self.refresh_lock:
+            with self.peer_lock:
+                if self.peer_cache and time.time() - self.peer_cache_time < PEER_CACHE_TTL:
+                    return list(self.peer_cache)
+
+            peers = self.fetch_peers()
+            if peers:
+                with self.peer_lock:
+                    self.peer_cache = peers
+                    self.peer_cache_time = time.time()
+
+        return list(peers)
+
+    def refresh_peers_background(self):
+
+        with self.peer_lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        def refresh():
+            try:
+                self.refresh_peers()
+            finally:
+                with self.peer_lock:
+                    self.refreshing = False
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    # forget a peer we couldn't connect to, and revalidate the rest on next use
+    def drop_peer(self, peer):
+
+        self.close_session(f"{peer['name']}:{peer['port']}")
+
+        with self.peer_lock:
+            if not self.peer_cache:
+                return
+            self.peer_cache = [entry for entry in self.peer_cache if entry['uuid'] != peer['uuid']]
+            if self.peer_cache:
+                self.peer_cache_time = min(self.peer_cache_time, time.time() - PEER_CACHE_TTL)
+            else:
+                self.peer_cache = None
+
+    # get peers straight from the nameserver
+    def fetch_peers(self):
+
         catalog = None
 
         for _ in range(RETRIES):
 
             try:
-                resp = requests.get(f'http://{CATALOG_SERVER}/query.json')
+                resp = self.get_session(CATALOG_SERVER).get(f'http://{CATALOG_SERVER}/query.json')
                 resp.raise_for_status() # raise an exception is bad response
 
                 # good response, get the JSON
@@ -59,23 +489,11 @@ class sPinClient:
         if not catalog:
             return []
 
-        # get peers from catalog
-        now = time.time()
-        all_peers = [entry for entry in catalog if entry.get('type', '') == ENTRY_TYPE and (now - entry.get('lastheardfrom') < CLIENT_STALENESS)]
-
-        # deduplicate the peers, keeping only the latest entry for a uuid
-        duplicates = {}
-        for peer in all_peers:
-            if peer['uuid'] in duplicates:
-                duplicates[peer['uuid']].append(peer)
-            else:
-                duplicates[peer['uuid']] = [peer]
-        peers = [max(dupes, key=lambda k: k['lastheardfrom']) for dupes in duplicates.values()]
-
-        return peers 
+        return parse_catalog(catalog)
         
     # Adds a file to the network
-    def sPinADD(self, filepath):
+    # if chunked, the file is stored as chunks plus a manifest, and the object id is for the manifest
+    def sPinADD(self, filepath, chunked=False):
         
         peers = self.get_peers()
         if not len(peers):
@@ -85,7 +503,16 @@ class sPinClient:
 
         # generate object id
         uuid_component = str(uuid.uuid4())
-        hash_component = self.get_digest(filepath)
+        if chunked:
+            try:
+                manifest, chunks = make_manifest(filepath)
+            except OSError as file_err:
+                if self.verbose:
+                    print(f'error: could not open file {filepath}: {file_err}')
+                return False
+            hash_component = hashlib.sha256(manifest).hexdigest()
+        else:
+            hash_component = self.get_digest(filepath)
         object_id = uuid_component + ':' + hash_component
         
         # figure out k
@@ -97,13 +524,40 @@ class sPinClient:
         # try to pin to all, retrying each as needed
         overall_success = []
         for peer in pin_to:
+            host = f"{peer['name']}:{peer['port']}"
+
+            # the peer won't take a manifest until it has every chunk
+            if chunked and not self.push_chunks(host, filepath, chunks):
+                overall_success.append(False)
+                continue
+
+            # no need to send the content if the peer already has it
+            if self.link(host, object_id):
+                overall_success.append(True)
+                continue
+
+            # big files go through an upload session, so a dropped connection only costs what hadn't arrived yet
+            if not chunked and os.path.getsize(filepath) >= UPLOAD_SESSION_MIN:
+                overall_success.append(self.upload_resumable(peer, filepath, object_id))
+                continue
+
             for _ in range(RETRIES):
                 try:
-                    with open(filepath, 'rb') as to_upload:
+                    with (io.BytesIO(manifest) if chunked else open(filepath, 'rb')) as to_upload:
                         multipart = {'data': to_upload}                                                                                                                                                                 
-                        resp = requests.post(f'''http://{peer['name']}:{peer['port']}/add/{object_id}''', files=multipart)
-                        resp.raise_for_status() # raise an exception if POST failed
-                        overall_success.append(True)
+                        resp = self.get_session(host).post(f'http://{host}/add/{object_id}', files=multipart)
+
+                    # the peer let some chunks go before the manifest got there, so find out which and send them again
+                    if chunked and resp.status_code == 409:
+                        if self.verbose:
+                            print(f'info: {host} is missing chunks for the manifest, sending them again')
+                        if not self.push_chunks(host, filepath, chunks):
+                            overall_success.append(False)
+                            break
+                        continue
+
+                    resp.raise_for_status() # raise an exception if POST failed
+                    overall_success.append(True)
                     break # leave this inner loop if we succeeded
                 except FileNotFoundError as file_err:
                     if self.verbose: 
@@ -112,6 +566,10 @@ class sPinClient:
                 except requests.RequestException as req_err:
                     if self.verbose: 
                         print(f'error: could not connect to peer: {req_err}')
+                    if isinstance(req_err, requests.ConnectionError):
+                        self.drop_peer(peer)
+            else:
+                overall_success.append(False) # ran out of retries
         
         # if all of those succeeded, return object id
         if all(overall_success):
@@ -119,8 +577,108 @@ class sPinClient:
         else:
             return False
         
+    # upload through a session on the peer, resuming from whatever it has committed after each failure
+    # gives up after RETRIES failures in a row that made no progress
+    def upload_resumable(self, peer, filepath, object_id):
+
+        host = f"{peer['name']}:{peer['port']}"
+        url = f'http://{host}/upload/{object_id}'
+
+        failures = 0
+        offset = 0
+        while failures < RETRIES:
+            try:
+                # carry on from however much the peer has
+                resp = self.get_session(host).get(url)
+                resp.raise_for_status()
+                committed = resp.json()['offset']
+                if committed > offset:
+                    failures = 0 # the last attempt got somewhere
+                offset = committed
+
+                with open(filepath, 'rb') as to_upload:
+                    size = os.fstat(to_upload.fileno()).st_size
+                    if offset < size:
+                        if self.verbose and offset:
+                            print(f'info: resuming upload to {host} from {offset} of {size} bytes')
+                        to_upload.seek(offset)
+                        resp = self.get_session(host).put(url, params={'offset': offset}, data=to_upload)
+                        resp.raise_for_status()
+
+                resp = self.get_session(host).post(f'{url}/complete')
+                resp.raise_for_status()
+                return True
+            except requests.RequestException as req_err:
+                if self.verbose:
+                    print(f'error: upload to peer interrupted: {req_err}')
+                if isinstance(req_err, requests.ConnectionError):
+                    self.drop_peer(peer)
+                failures += 1
+            except OSError as file_err: # after RequestException, which is one
+                if self.verbose:
+                    print(f'error: could not open file {filepath}: {file_err}')
+                return False
+            except (ValueError, KeyError) as resp_err:
+                if self.verbose:
+                    print(f'error: bad upload status from peer: {resp_err}')
+                failures += 1
+
+        return False
+
+    # ask a peer to pin object_id against content it already holds
+    # returns whether it could, in which case there's nothing to upload
+    def link(self, host, object_id):
+
+        try:
+            resp = self.get_session(host).post(f'http://{host}/link/{object_id}')
+            return resp.status_code == 200
+        except requests.RequestException as req_err:
+            if self.verbose:
+                print(f'error: could not ask peer to link: {req_err}')
+            return False
+
+    # send a peer the chunks it doesn't already have, returning whether it has them all now
+    def push_chunks(self, host, filepath, chunks):
+
+        # a chunk can turn up more than once in a file, it only needs sending once
+        unique = {}
+        for offset, size, hash in chunks:
+            unique.setdefault(hash, (offset, size))
+
+        try:
+            resp = self.get_session(host).post(f'http://{host}/chunks', json=list(unique))
+            resp.raise_for_status()
+            missing = resp.json()['missing']
+        except (requests.RequestException, ValueError, KeyError) as req_err:
+            if self.verbose:
+                print(f'error: could not ask peer which chunks it has: {req_err}')
+            return False
+
+        if self.verbose:
+            print(f'info: {host} needs {len(missing)} of {len(unique)} chunks')
+
+        with open(filepath, 'rb') as to_upload:
+            for hash in missing:
+                offset, size = unique[hash]
+                to_upload.seek(offset)
+                data = to_upload.read(size)
+
+                for _ in range(RETRIES):
+                    try:
+                        resp = self.get_session(host).post(f'http://{host}/chunk/{hash}', data=data)
+                        resp.raise_for_status()
+                        break
+                    except requests.RequestException as req_err:
+                        if self.verbose:
+                            print(f'error: could not send chunk to peer: {req_err}')
+                else:
+                    return False
+
+        return True
+
     # Gets the file associated with the given key
-    def sPinGET(self, object_id, filepath):
+    # with sources > 1, pulls ranges of it from that many peers at once, falling back to one peer at a time if that fails
+    def sPinGET(self, object_id, filepath, sources=1):
 
         peers = self.get_peers()
         if not len(peers):
@@ -128,6 +686,37 @@ class sPinClient:
                 print('error: no peers found')
             return False # return early if no peers found
 
+        # a copy in the local cache only needs a peer to confirm the object is still there, which one conditional request does
+        object_hash = object_id.split(':')[1]
+        cached = self.local is not None and self.local.has(object_hash)
+
+        success = False
+        if sources > 1 and not cached:
+            success = self.get_ranged(object_id, filepath, peers, sources)
+        if not success:
+            success = self.get_whole(object_id, filepath, peers, cached)
+
+        # whatever came down has been checked against its hash, so keep it for next time
+        if success and self.local is not None:
+            self.local.put_file(object_hash, filepath)
+
+        # if what we got was a manifest, put the file back together from its chunks
+        if success:
+            try:
+                manifest = read_manifest(filepath)
+            except OSError as file_err:
+                if self.verbose:
+                    print(f'error: could not read back file: {file_err}')
+                return False
+            if manifest is not None:
+                success = self.get_chunks(object_id, manifest, peers, filepath)
+
+        return success
+
+    # download the whole object from the first peer that will provide it
+    # if cached, the local cache has it, and it's copied from there as long as the peer says it's unchanged
+    def get_whole(self, object_id, filepath, peers, cached=False):
+
         # get hash component of object id
         object_hash = object_id.split(':')[1]
 
@@ -138,12 +727,26 @@ class sPinClient:
         # no retries here, we're trying every peer
         for peer in to_try:
             try:
-                resp = requests.get(f'''http://{peer['name']}:{peer['port']}/get/{object_id}''')
+                host = f"{peer['name']}:{peer['port']}"
+                headers = {'If-None-Match': f'"{object_hash}"'} if cached else None
+                resp = self.get_session(host).get(f'http://{host}/get/{object_id}', headers=headers)
                 resp.raise_for_status() # raise error if bad result
 
+                # peer says our copy is good
+                if cached and resp.status_code == 304:
+                    if self.local.copy(object_hash, filepath):
+                        success = True
+                        break
+                    # it went missing since, so ask for the whole thing after all
+                    cached = False
+                    resp = self.get_session(host).get(f'http://{host}/get/{object_id}')
+                    resp.raise_for_status()
+
                 # try to write to file
                 # implement a streaming hash check at the same time
-                with open(filepath, 'wb') as file:
+                # it goes to a temp file first, since filepath may be a link into the local cache from an earlier get
+                temp_location = f'{filepath}.whole'
+                with open(temp_location, 'wb') as file:
                     hash = hashlib.sha256()
                     for chunk in resp.iter_content(chunk_size=hash.block_size):
                         hash.update(chunk)
@@ -153,22 +756,207 @@ class sPinClient:
                 if object_hash != hash.hexdigest():
                     if self.verbose:
                         print(f'error: retrieved data hash of {hash.hexdigest()} did not match object hash of {object_hash}')
-                    os.unlink(filepath)
+                    os.unlink(temp_location)
                     return False
                 else:
+                    os.replace(temp_location, filepath)
                     success = True
                     break
             except requests.RequestException as req_err:
                 if self.verbose:
                     print(f'error: could not retrieve object from peer, trying next if possible')
+                if isinstance(req_err, requests.ConnectionError):
+                    self.drop_peer(peer)
             except OSError as file_err:
                 if self.verbose: 
                     print(f'error: could not write to file: {file_err}')
                 return False
 
         return success
+
+    # download the object in ranges from up to sources peers at once, checking the hash once it's all there
+    def get_ranged(self, object_id, filepath, peers, sources):
+
+        object_hash = object_id.split(':')[1]
+        temp_location = f'{filepath}.ranges'
+
+        # find peers that hold the object, and its size, with a one byte request to each
+        # about 1 in K_DENOM peers pins any given object, so ask that many times more than we want
+        to_probe = random.sample(peers, k=min(len(peers), sources * K_DENOM))
+        with concurrent.futures.ThreadPoolExecutor(len(to_probe)) as pool:
+            sizes = list(pool.map(lambda peer: self.probe_range(peer, object_id), to_probe))
+        found = [(peer, size) for peer, size in zip(to_probe, sizes) if size is not None][:sources]
+
+        if not found:
+            if self.verbose:
+                print('info: no peer could serve ranges, downloading from one at a time')
+            return False
+
+        size = found[0][1]
+        work = RangeWork(size, RANGE_PART_SIZE)
+
+        if self.verbose:
+            print(f'info: downloading {size} bytes in {work.total} parts from {len(found)} peers')
+
+        try:
+            with open(temp_location, 'wb') as file:
+                file.truncate(size)
+
+            with concurrent.futures.ThreadPoolExecutor(len(found)) as pool:
+                list(pool.map(lambda peer: self.range_worker(peer, object_id, temp_location, work), [peer for peer, _ in found]))
+
+            if not work.complete():
+                if self.verbose:
+                    print(f'error: only {len(work.done)} of {work.total} parts arrived')
+                os.unlink(temp_location)
+                return False
+
+            # all there, make sure it's right
+            if file_digest(temp_location) != object_hash:
+                if self.verbose:
+                    print(f'error: assembled data did not match object hash of {object_hash}')
+                os.unlink(temp_location)
+                return False
+
+            os.replace(temp_location, filepath)
+        except OSError as file_err:
+            if self.verbose:
+                print(f'error: could not write to file: {file_err}')
+            return False
+
+        return True
+
+    # the size of object_id if peer holds it and will serve ranges of it, None otherwise
+    def probe_range(self, peer, object_id):
+
+        try:
+            host = f"{peer['name']}:{peer['port']}"
+            resp = self.get_session(host).get(f'http://{host}/get/{object_id}', headers={'Range': 'bytes=0-0'}, timeout=RANGE_TIMEOUT)
+            if resp.status_code != 206:
+                return None
+            return int(resp.headers['Content-Range'].rsplit('/', 1)[1]) # bytes 0-0/SIZE
+        except requests.RequestException as req_err:
+            if isinstance(req_err, requests.ConnectionError):
+                self.drop_peer(peer)
+            return None
+        except (KeyError, ValueError):
+            return None
+
+    # fetch parts from one peer until there are none left, stopping early if the peer fails
+    def range_worker(self, peer, object_id, filepath, work):
+
+        host = f"{peer['name']}:{peer['port']}"
+
+        with open(filepath, 'r+b') as file:
+            while True:
+                part = work.next()
+                if part is None:
+                    return
+
+                start, end = part
+                ok = False
+                try:
+                    resp = self.get_session(host).get(f'http://{host}/get/{object_id}', headers={'Range': f'bytes={start}-{end}'}, stream=True, timeout=RANGE_TIMEOUT)
+                    if resp.status_code == 206:
+                        file.seek(start)
+                        received = 0
+                        for chunk in resp.iter_content(chunk_size=RANGE_READ_SIZE):
+                            file.write(chunk)
+                            received += len(chunk)
+                            if work.is_done(part): # someone faster got it first
+                                break
+                        ok = received == end - start + 1
+                    resp.close()
+                except requests.RequestException as req_err:
+                    if self.verbose:
+                        print(f'error: could not retrieve range from {host}: {req_err}')
+                    if isinstance(req_err, requests.ConnectionError):
+                        self.drop_peer(peer)
+
+                file.flush()
+                work.finish(part, ok)
+                if not ok and not work.is_done(part):
+                    return # leave the rest to peers that are working
+
+    # fetch every chunk in a manifest in parallel, writing them into place in filepath
+    def get_chunks(self, object_id, manifest, peers, filepath):
+
+        temp_location = f'{filepath}.chunks'
+
+        # where each distinct chunk goes
+        offsets = {}
+        offset = 0
+        for hash, size in manifest['chunks']:
+            offsets.setdefault(hash, []).append(offset)
+            offset += size
+
+        try:
+            with open(temp_location, 'wb') as file:
+                file.truncate(manifest['size'])
+
+            with concurrent.futures.ThreadPoolExecutor(CHUNK_WORKERS) as pool:
+                results = list(pool.map(lambda hash: self.get_chunk(object_id, hash, offsets[hash], peers, temp_location), offsets))
+
+            if not all(results):
+                os.unlink(temp_location)
+                return False
+
+            os.replace(temp_location, filepath)
+        except OSError as file_err:
+            if self.verbose:
+                print(f'error: could not write to file: {file_err}')
+            return False
+
+        return True
+
+    # fetch one chunk from whichever peer will provide it, and write it at each of its offsets
+    # peers that don't hold the chunk fetch it from ones pinning object_id
+    def get_chunk(self, object_id, hash, offsets, peers, filepath):
+
+        # chunks are kept in the local cache too, and the manifest they came from was just checked with a peer
+        if self.local is not None and self.local.has(hash):
+            try:
+                with open(self.local.location(hash), 'rb') as file:
+                    data = file.read()
+                if hashlib.sha256(data).hexdigest() == hash:
+                    self.write_chunk(data, offsets, filepath)
+                    return True
+            except OSError:
+                pass
+
+        for peer in random.sample(peers, k=len(peers)):
+            try:
+                host = f"{peer['name']}:{peer['port']}"
+                resp = self.get_session(host).get(f'http://{host}/chunk/{hash}', params={'object': object_id})
+                resp.raise_for_status()
+            except requests.RequestException as req_err:
+                if isinstance(req_err, requests.ConnectionError):
+                    self.drop_peer(peer)
+                continue
+
+            if hashlib.sha256(resp.content).hexdigest() != hash:
+                if self.verbose:
+                    print(f'error: chunk {hash} from {host} did not match its hash, trying next if possible')
+                continue
+
+            self.write_chunk(resp.content, offsets, filepath)
+            if self.local is not None:
+                self.local.put_data(hash, resp.content)
+            return True
+
+        if self.verbose:
+            print(f'error: could not retrieve chunk {hash} from any peer')
+        return False
         
         
+    # write a chunk's data at each of its offsets in filepath
+    def write_chunk(self, data, offsets, filepath):
+
+        with open(filepath, 'r+b') as file:
+            for offset in offsets:
+                file.seek(offset)
+                file.write(data)
+
     # Requests deletion of the file associated with the given key
     def sPinDEL(self, object_id):
         
@@ -189,34 +977,284 @@ class sPinClient:
         for peer in del_from:
             for _ in range(RETRIES):
                 try:
-                    resp = requests.post(f'''http://{peer['name']}:{peer['port']}/del/{object_id}''')
+                    host = f"{peer['name']}:{peer['port']}"
+                    resp = self.get_session(host).post(f'http://{host}/del/{object_id}')
                     resp.raise_for_status() # raise an exception if POST failed
                     overall_success = True
                     break # leave this inner loop if we succeeded
                 except requests.RequestException as req_err:
                     if self.verbose: 
                         print(f'error: could not connect to peer: {req_err}')
+                    if isinstance(req_err, requests.ConnectionError):
+                        self.drop_peer(peer)
         
         return overall_success
 
     # helper to get hexdigest of a file
     def get_digest(self, filepath):
 
-        hash = hashlib.sha256()
-
         try:
-            with open(filepath, 'rb') as to_hash:
-                while True:
-                    chunk = to_hash.read(hash.block_size)
-                    if not chunk:
-                        break
-                    hash.update(chunk)
+            return file_digest(filepath)
         except FileNotFoundError as file_err:
             if self.main: print(f'error: could not open file {filepath}')
             sys.exit(1)
-            
-        return hash.hexdigest()
     
+# asyncio version of the client
+# uploads to the k pins (and deletes from them) concurrently over one shared connection pool,
+# so a single process can keep many operations in flight at once
+class AsyncSPinClient:
+    def __init__(self, verbose=False, limit=ASYNC_CONN_LIMIT):
+        self.verbose = verbose
+        self.limit = limit
+        self.session = None
+
+        # cached peer list, same rules as the sync client
+        self.peer_cache = None
+        self.peer_cache_time = 0
+        self.refresh_task = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    # shared session, made lazily so it gets bound to the running loop
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.limit))
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    # get peers, from the cache when possible
+    async def get_peers(self):
+
+        age = time.time() - self.peer_cache_time
+
+        # fresh enough to use as is
+        if self.peer_cache and age < PEER_CACHE_TTL:
+            return list(self.peer_cache)
+
+        # stale but still usable, hand it out while the nameserver is asked again in the background
+        if self.peer_cache and age < CLIENT_STALENESS:
+            self.refresh_peers()
+            return list(self.peer_cache)
+
+        # nothing usable, wait on the nameserver (along with anyone else already waiting)
+        # shielded so one cancelled caller doesn't cancel the fetch for everyone
+        return list(await asyncio.shield(self.refresh_peers()))
+
+    # start a refresh if one isn't already going, returning the task for it
+    def refresh_peers(self):
+
+        if self.refresh_task is None or self.refresh_task.done():
+            self.refresh_task = asyncio.ensure_future(self.fetch_peers_into_cache())
+        return self.refresh_task
+
+    async def fetch_peers_into_cache(self):
+
+        peers = await self.fetch_peers()
+        if peers:
+            self.peer_cache = peers
+            self.peer_cache_time = time.time()
+        return peers
+
+    # forget a peer we couldn't connect to, and revalidate the rest on next use
+    def drop_peer(self, peer):
+
+        if not self.peer_cache:
+            return
+        self.peer_cache = [entry for entry in self.peer_cache if entry['uuid'] != peer['uuid']]
+        if self.peer_cache:
+            self.peer_cache_time = min(self.peer_cache_time, time.time() - PEER_CACHE_TTL)
+        else:
+            self.peer_cache = None
+
+    # get peers straight from the nameserver
+    async def fetch_peers(self):
+
+        catalog = None
+
+        for _ in range(RETRIES):
+
+            try:
+                async with self.get_session().get(f'http://{CATALOG_SERVER}/query.json') as resp:
+                    resp.raise_for_status() # raise an exception is bad response
+
+                    # good response, get the JSON
+                    catalog = await resp.json(content_type=None) # nameserver doesn't label it as json
+                break # break the retry loop
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+                if self.verbose:
+                    print(f'error: could not communicate with nameserver: {err}')
+
+        # return early if getting peers failed
+        if not catalog:
+            return []
+
+        return parse_catalog(catalog)
+
+    # Adds a file to the network
+    async def add(self, filepath):
+
+        peers = await self.get_peers()
+        if not len(peers):
+            if self.verbose:
+                print('error: no peers found')
+            return False # return early if no peers found
+
+        # generate object id, hashing off the loop
+        try:
+            hash_component = await asyncio.get_running_loop().run_in_executor(None, file_digest, filepath)
+        except FileNotFoundError as file_err:
+            if self.verbose:
+                print(f'error: could not open file {filepath}: {file_err}')
+            return False
+        object_id = str(uuid.uuid4()) + ':' + hash_component
+
+        # figure out k
+        k = math.ceil(len(peers) / K_DENOM)
+
+        # figure out which peers to pin to
+        # no repeats, since two concurrent uploads to one peer would fight over its temp file
+        pin_to = random.sample(peers, k=min(k, len(peers)))
+
+        # pin to all at once, each retrying as needed
+        results = await asyncio.gather(*[self.upload(peer, filepath, object_id) for peer in pin_to])
+
+        # if all of those succeeded, return object id
+        if all(results):
+            return object_id
+        else:
+            return False
+
+    # upload to a single peer, retrying as needed
+    async def upload(self, peer, filepath, object_id):
+
+        # no need to send the content if the peer already has it
+        if await self.link(peer, object_id):
+            return True
+
+        for _ in range(RETRIES):
+            try:
+                with open(filepath, 'rb') as to_upload:
+                    multipart = {'data': to_upload}
+                    async with self.get_session().post(f'''http://{peer['name']}:{peer['port']}/add/{object_id}''', data=multipart) as resp:
+                        resp.raise_for_status() # raise an exception if POST failed
+                return True
+            except FileNotFoundError as file_err:
+                if self.verbose:
+                    print(f'error: could not open file {filepath}: {file_err}')
+                return False
+            except (aiohttp.ClientError, asyncio.TimeoutError) as req_err:
+                if self.verbose:
+                    print(f'error: could not connect to peer: {req_err}')
+                if isinstance(req_err, aiohttp.ClientConnectionError):
+                    self.drop_peer(peer)
+
+        return False
+
+    # ask a peer to pin object_id against content it already holds
+    # returns whether it could, in which case there's nothing to upload
+    async def link(self, peer, object_id):
+
+        try:
+            async with self.get_session().post(f'''http://{peer['name']}:{peer['port']}/link/{object_id}''') as resp:
+                return resp.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError) as req_err:
+            if self.verbose:
+                print(f'error: could not ask peer to link: {req_err}')
+            return False
+
+    # Gets the file associated with the given key
+    async def get(self, object_id, filepath):
+
+        peers = await self.get_peers()
+        if not len(peers):
+            if self.verbose:
+                print('error: no peers found')
+            return False # return early if no peers found
+
+        # get hash component of object id
+        object_hash = object_id.split(':')[1]
+
+        # figure out a few to try
+        to_try = random.sample(peers, k=len(peers))
+
+        # no retries here, we're trying every peer
+        for peer in to_try:
+            try:
+                async with self.get_session().get(f'''http://{peer['name']}:{peer['port']}/get/{object_id}''') as resp:
+                    resp.raise_for_status() # raise error if bad result
+
+                    # try to write to file
+                    # implement a streaming hash check at the same time
+                    with open(filepath, 'wb') as file:
+                        hash = hashlib.sha256()
+                        async for chunk in resp.content.iter_chunked(hash.block_size * 1024):
+                            hash.update(chunk)
+                            file.write(chunk)
+
+                # check that hashes are same, if not, unlink file
+                if object_hash != hash.hexdigest():
+                    if self.verbose:
+                        print(f'error: retrieved data hash of {hash.hexdigest()} did not match object hash of {object_hash}')
+                    os.unlink(filepath)
+                    return False
+                else:
+                    return True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as req_err:
+                if self.verbose:
+                    print('error: could not retrieve object from peer, trying next if possible')
+                if isinstance(req_err, aiohttp.ClientConnectionError):
+                    self.drop_peer(peer)
+            except OSError as file_err:
+                if self.verbose:
+                    print(f'error: could not write to file: {file_err}')
+                return False
+
+        return False
+
+    # Requests deletion of the file associated with the given key
+    async def delete(self, object_id):
+
+        peers = await self.get_peers()
+        if not len(peers):
+            if self.verbose:
+                print('error: no peers found')
+            return False # return early if no peers found
+
+        # figure out k
+        k = math.ceil(len(peers) / K_DENOM)
+
+        # figure out which peers to request del from
+        del_from = random.sample(peers, k=min(k, len(peers)))
+
+        # request from all at once, succeeding if any of them took it
+        results = await asyncio.gather(*[self.request_del(peer, object_id) for peer in del_from])
+
+        return any(results)
+
+    # deletion request to a single peer, retrying as needed
+    async def request_del(self, peer, object_id):
+
+        for _ in range(RETRIES):
+            try:
+                async with self.get_session().post(f'''http://{peer['name']}:{peer['port']}/del/{object_id}''') as resp:
+                    resp.raise_for_status() # raise an exception if POST failed
+                return True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as req_err:
+                if self.verbose:
+                    print(f'error: could not connect to peer: {req_err}')
+                if isinstance(req_err, aiohttp.ClientConnectionError):
+                    self.drop_peer(peer)
+
+        return False
+
 # CLI options
 # ADD
 # program add file
@@ -226,10 +1264,12 @@ class sPinClient:
 # program del object_id
 if __name__ == '__main__':
 
-    client = sPinClient(verbose=True)
+    # SPIN_CACHE_DIR keeps what's downloaded there, so getting it again needn't download it again
+    client = sPinClient(verbose=True, cache_dir=os.getenv('SPIN_CACHE_DIR'))
 
     usage = f'''usage:
         {sys.argv[0]} add <filename> - add contents of <filename> to system, returning object id
+        {sys.argv[0]} addchunked <filename> - same, but stored as chunks shared with any other chunked object
         {sys.argv[0]} get <object id> <filename> - get data for <object id>, if present, saving to <filename>
         {sys.argv[0]} del <object id> - make a deletion request for <object id>
         {sys.argv[0]} help - display this message
@@ -247,7 +1287,7 @@ if __name__ == '__main__':
 
         # get all arguments into a form we can use
         op = sys.argv[1].lower()
-        if op == 'add':
+        if op in ('add', 'addchunked'):
             filename = sys.argv[2]
         else:
             object_id = sys.argv[2]
@@ -265,8 +1305,8 @@ if __name__ == '__main__':
 
         exit_code = 0
 
-        if op == 'add':
-            result = client.sPinADD(filename)
+        if op in ('add', 'addchunked'):
+            result = client.sPinADD(filename, chunked=(op == 'addchunked'))
             if result:
                 print(result) # it's the object id
             else:
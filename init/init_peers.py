@@ -27,6 +27,8 @@ def init_peers(peers_dir, peer_name, num_peers):
             shutil.copy(os.path.join('../../server/', file), '.')
         os.mkdir('pinned_files/')
         os.mkdir('cached_files/')
+        os.mkdir('chunked_files/')
+        os.mkdir('uploading_files/')
         os.mkdir('meta/')
         os.chdir('meta/')
         n = open('name', 'x')
@@ -0,0 +1,211 @@
+#!/bin/usr/env python3
+
+# John Sullivan (jsulli28), Jozef Porubcin (jporubci)
+# cache.py
+
+import time
+
+# one odd multiplier per row of the frequency sketch, so each row spreads keys out its own way
+SEEDS = [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93]
+WORD = (1 << 64) - 1
+MAX_COUNT = 15 # counters stop here, it only has to tell hot from cold
+HALVE = bytes(count >> 1 for count in range(256))
+
+# Size-bounded cache table with LRU eviction and TinyLFU admission.
+#
+# Entries are kept least recently used first in a dict, so a hit is a pop and reinsert, and eviction takes from the
+# front. Their sizes are added up as they come and go, so the cache is kept under capacity on every insert rather
+# than by scanning the directory every so often.
+#
+# Every lookup, hit or miss, is counted in a count-min sketch of how often each key has been asked for. Once it's
+# counted sample lookups, every count is halved, so popularity fades if it isn't kept up. A new entry only gets in
+# if it's been asked for at least as often as each entry it would push out, so a one-off scan through cold objects
+# can't flush the hot ones.
+class ObjectCache:
+
+    def __init__(self, capacity, width):
+        self.capacity = capacity # bytes
+
+        # key -> [size, last used], least recently used first
+        self.entries = {}
+        self.size = 0
+
+        # width must be a power of two
+        self.sketch = [bytearray(width) for _ in SEEDS]
+        self.shift = 64 - (width.bit_length() - 1)
+        self.sample = 10 * width
+        self.counted = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def items(self):
+        return self.entries.items()
+
+    # counters for key, one in each row of the sketch
+    def slots(self, key):
+        hashed = hash(key) & WORD
+        return [(row, ((hashed * seed) & WORD) >> self.shift) for seed, row in zip(SEEDS, self.sketch)]
+
+    # how often key has been asked for lately
+    def frequency(self, key):
+        return min(row[slot] for row, slot in self.slots(key))
+
+    # count a request for key
+    # only the smallest counters go up, so keys sharing a counter with a hot one aren't overcounted as much
+    def record(self, key):
+        slots = self.slots(key)
+        least = min(row[slot] for row, slot in slots)
+        if least < MAX_COUNT:
+            for row, slot in slots:
+                if row[slot] == least:
+                    row[slot] = least + 1
+
+        self.counted += 1
+        if self.counted >= self.sample:
+            self.sketch = [row.translate(HALVE) for row in self.sketch]
+            self.counted //= 2
+
+    # look key up, counting the request and marking it used if it's there
+    def lookup(self, key):
+        self.record(key)
+
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return False
+
+        entry[1] = time.time()
+        self.entries[key] = entry
+        self.hits += 1
+        return True
+
+    # offer key for caching, returning whether it was let in and the keys evicted to make room
+    # the caller is expected to have looked it up first, so the request for it is already counted
+    def admit(self, key, size):
+
+        # already in, so just update it
+        if key in self.entries:
+            self.remove(key)
+            self.load(key, size, time.time())
+            return True, self.trim()
+
+        if size > self.capacity:
+            self.rejected += 1
+            return False, []
+
+        # least recently used go first, but only if they're no more popular than what's coming in
+        need = self.size + size - self.capacity
+        frequency = self.frequency(key)
+        victims = []
+        for victim, (victim_size, _) in self.entries.items():
+            if need <= 0:
+                break
+            if self.frequency(victim) > frequency:
+                self.rejected += 1
+                return False, []
+            victims.append(victim)
+            need -= victim_size
+
+        for victim in victims:
+            self.remove(victim)
+        self.evictions += len(victims)
+
+        self.entries[key] = [size, time.time()]
+        self.size += size
+        self.admitted += 1
+        return True, victims
+
+    # put back an entry from before, as most recently used so far, for rebuilding the table at startup
+    # frequency is how often it had been asked for, so a scan right after a restart can't flush what was hot
+    def load(self, key, size, last_used, frequency=0):
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = [size, last_used]
+        self.size += size
+
+        frequency = min(frequency, MAX_COUNT)
+        for row, slot in self.slots(key):
+            row[slot] = max(row[slot], frequency)
+
+    # evict least recently used entries until the cache fits, returning their keys
+    def trim(self):
+        evicted = []
+        while self.size > self.capacity:
+            key = next(iter(self.entries))
+            self.remove(key)
+            evicted.append(key)
+        self.evictions += len(evicted)
+        return evicted
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'evictions': self.evictions,
+        }
+
+# Small objects kept in memory along with the headers to send them with, so they can be answered without opening
+# a file. Which ones stay is up to an ObjectCache of their sizes, so the same LRU and TinyLFU rules apply.
+class MemoryTier:
+
+    def __init__(self, capacity, max_object, width):
+        self.max_object = max_object # bytes, anything bigger is never kept
+        self.index = ObjectCache(capacity, width)
+
+        # key -> (body, headers)
+        self.objects = {}
+
+    def __contains__(self, key):
+        return key in self.objects
+
+    # body and headers for key, or None if it isn't held
+    # only hits are counted here, a miss is counted when the object is offered with put
+    def get(self, key):
+        if key not in self.objects:
+            return None
+        self.index.lookup(key)
+        return self.objects[key]
+
+    # offer an object that was just read from disk, returning whether it's kept
+    def put(self, key, body, headers):
+        self.index.lookup(key)
+        if len(body) > self.max_object:
+            return False
+
+        admitted, evicted = self.index.admit(key, len(body))
+        for old in evicted:
+            self.objects.pop(old, None)
+        if admitted:
+            self.objects[key] = (body, headers)
+        return admitted
+
+    def remove(self, key):
+        self.index.remove(key)
+        self.objects.pop(key, None)
+
+    def stats(self):
+        stats = self.index.stats()
+        stats['max_object'] = self.max_object
+        return stats
@@ -0,0 +1,39 @@
+#!/bin/usr/env python3
+
+# John Sullivan (jsulli28), Jozef Porubcin (jporubci)
+# chunk_funcs.py
+
+import json
+import string
+
+# Chunked objects.
+#
+# A chunked object is pinned like any other, but its content is a manifest rather than the file itself:
+#   MANIFEST_MAGIC followed by JSON {'size': total bytes, 'hash': sha256 of the whole file, 'chunks': [[sha256, size], ...]}
+# The chunks it lists are kept in the chunk store once each, however many manifests list them. The client does the
+# chunking and puts the file back together, so the server only has to know which chunks each manifest needs.
+
+MANIFEST_MAGIC = b'spin-manifest\n' # must match the client's
+
+# whether value looks like a sha256 hex digest, and so is safe to use as a filename
+def is_hash(value):
+    return isinstance(value, str) and len(value) == 64 and all(c in string.hexdigits and not c.isupper() for c in value)
+
+# Reads the distinct chunk hashes a manifest lists, in order.
+# Returns None if the file isn't a manifest. A broken manifest is treated the same, so it's kept as a plain object.
+# Raises OSError if the file can't be read.
+def read_manifest(path):
+    with open(path, 'rb') as file:
+        if file.read(len(MANIFEST_MAGIC)) != MANIFEST_MAGIC:
+            return None
+        data = file.read()
+
+    try:
+        chunks = [chunk[0] for chunk in json.loads(data)['chunks']]
+    except (ValueError, KeyError, TypeError, IndexError):
+        return None
+
+    if not all(is_hash(chunk) for chunk in chunks):
+        return None
+
+    return tuple(dict.fromkeys(chunks))
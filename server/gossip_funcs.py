@@ -0,0 +1,118 @@
+#!/bin/usr/env python3
+
+# John Sullivan (jsulli28), Jozef Porubcin (jporubci)
+# gossip_funcs.py
+
+import itertools
+import struct
+import uuid
+import zlib
+
+# Compact binary encoding for /info gossip payloads.
+#
+# Carries the same dicts the JSON format does (see sPinServer.gossip_payload), but the sender and epoch are
+# declared once in the header and each UUID:HASH object is packed as a 16 byte UUID plus 32 byte digest.
+#
+# Layout (network byte order):
+#   header: magic 'sPin', flags, node uuid, epoch uuid, seq, base (0 for snapshots), record count
+#   body:   snapshot -> count x (uuid, digest)
+#           delta    -> count x (seq, op, uuid, digest) with op 1 for ADD and 0 for DEL
+# The body is zlib compressed when FLAG_COMPRESSED is set.
+
+CONTENT_TYPE = 'application/x-spin-gossip'
+
+MAGIC = b'sPin'
+FLAG_COMPRESSED = 0x1
+FLAG_DELTA = 0x2
+
+HEADER = struct.Struct('!4sB16s16sQQI')
+OBJECT_SIZE = 48
+DELTA_RECORD = struct.Struct('!QB48s')
+
+# text layout of a UUID:HASH id, with the separators skipped
+OBJECT_ID_LEN = 101
+OBJECT_ID_FIELDS = struct.Struct('8sx4sx4sx4sx12sx64s')
+SEPARATORS = {8: b'-', 13: b'-', 18: b'-', 23: b'-', 36: b':'}
+
+# Packs UUID:HASH object ids into 48 bytes each.
+# Raises ValueError if any id isn't a lowercase uuid and sha256 hex digest, since only those survive the round trip.
+# Works on all the ids joined together rather than one at a time, since this runs over whole pin tables.
+def pack_objects(object_ids):
+    count = len(object_ids)
+    joined = ''.join(object_ids).encode()
+
+    if any(len(object_id) != OBJECT_ID_LEN for object_id in object_ids) or joined != joined.lower():
+        raise ValueError('cannot pack object ids')
+    for position, separator in SEPARATORS.items():
+        if joined[position::OBJECT_ID_LEN] != separator * count:
+            raise ValueError('cannot pack object ids')
+
+    fields = itertools.chain.from_iterable(OBJECT_ID_FIELDS.iter_unpack(joined))
+    return bytes.fromhex(b''.join(fields).decode()) # also rejects anything that isn't hex
+
+def unpack_objects(packed):
+    hex_ids = packed.hex()
+    return [
+        f'{hex_ids[i:i + 8]}-{hex_ids[i + 8:i + 12]}-{hex_ids[i + 12:i + 16]}-{hex_ids[i + 16:i + 20]}-{hex_ids[i + 20:i + 32]}:{hex_ids[i + 32:i + 96]}'
+        for i in range(0, len(hex_ids), 2 * OBJECT_SIZE)
+    ]
+
+# Encodes a gossip payload dict.
+# Raises ValueError if any object id can't be packed, in which case the caller should send JSON instead.
+def encode_gossip(body, compress_min=None):
+    if 'snapshot' in body:
+        flags = 0
+        base = 0
+        records = pack_objects(body['snapshot'])
+        count = len(body['snapshot'])
+    else:
+        flags = FLAG_DELTA
+        base = body['base']
+        objects = pack_objects([obj for _, _, obj in body['changes']])
+        records = b''.join([
+            DELTA_RECORD.pack(seq, 1 if op == 'ADD' else 0, objects[i * OBJECT_SIZE:(i + 1) * OBJECT_SIZE])
+            for i, (seq, op, _) in enumerate(body['changes'])
+        ])
+        count = len(body['changes'])
+
+    if compress_min is not None and len(records) >= compress_min:
+        flags |= FLAG_COMPRESSED
+        records = zlib.compress(records, 1) # cheap level, most of this is random digests anyway
+
+    header = HEADER.pack(MAGIC, flags, uuid.UUID(body['node']).bytes, uuid.UUID(body['epoch']).bytes, body['seq'], base, count)
+
+    return header + records
+
+# Decodes a payload made by encode_gossip back into the dict JSON would have given.
+# Raises ValueError if it's malformed.
+def decode_gossip(data):
+    try:
+        magic, flags, node, epoch, seq, base, count = HEADER.unpack_from(data)
+    except struct.error as err:
+        raise ValueError(f'bad gossip header: {err}')
+
+    if magic != MAGIC:
+        raise ValueError('bad gossip magic')
+
+    records = data[HEADER.size:]
+    if flags & FLAG_COMPRESSED:
+        try:
+            records = zlib.decompress(records)
+        except zlib.error as err:
+            raise ValueError(f'bad gossip compression: {err}')
+
+    record_size = DELTA_RECORD.size if flags & FLAG_DELTA else OBJECT_SIZE
+    if len(records) != count * record_size:
+        raise ValueError('gossip record count does not match body')
+
+    body = {'node': str(uuid.UUID(bytes=node)), 'epoch': str(uuid.UUID(bytes=epoch)), 'seq': seq}
+
+    if flags & FLAG_DELTA:
+        changes = list(DELTA_RECORD.iter_unpack(records))
+        objects = unpack_objects(b''.join([packed for _, _, packed in changes]))
+        body['base'] = base
+        body['changes'] = [(change_seq, 'ADD' if op else 'DEL', obj) for (change_seq, op, _), obj in zip(changes, objects)]
+    else:
+        body['snapshot'] = unpack_objects(records)
+
+    return body
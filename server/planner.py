@@ -0,0 +1,53 @@
+#!/bin/usr/env python3
+
+# John Sullivan (jsulli28), Jozef Porubcin (jporubci)
+# planner.py
+
+# Tracks which locally pinned objects are under- or over-replicated.
+#
+# The server tells the planner whenever an object's replica count might have changed (gossip added or expired a
+# record for it, or it was pinned or unpinned here), and whenever k changes. Only objects that need action are
+# kept, so a maintenance pass touches those instead of every object in the worldview.
+#
+# Only one pin acts on an object, as in pin_funcs: the lowest named adds pins and the highest named drops them. So
+# along with the count, the server says whether this node is the lowest and the highest named of the object's pins,
+# and objects some other pin is responsible for aren't kept.
+#
+# Counts follow maintain's convention: the number of *other* nodes known to pin the object.
+class ReplicationPlanner:
+
+    def __init__(self):
+        self.k = None
+
+        # UUID:HASH -> count of other known pins, only for objects where that count isn't k and it's ours to fix
+        self.queued = {}
+
+    def __len__(self):
+        return len(self.queued)
+
+    # whether this node should act on an object with count other pins
+    # lowest and highest say whether this node is the lowest and highest named of its pins
+    def responsible(self, count, lowest, highest):
+        return (count < self.k and lowest) or (count > self.k and highest)
+
+    # re-evaluate one object
+    def update(self, obj, pinned, count, lowest, highest):
+        if pinned and self.k is not None and self.responsible(count, lowest, highest):
+            self.queued[obj] = count
+        else:
+            self.queued.pop(obj, None)
+
+    # set k, re-evaluating everything if it changed
+    # counts is an iterable of (UUID:HASH, count, lowest, highest) for every locally pinned object
+    def set_k(self, k, counts):
+        if k == self.k:
+            return False
+
+        self.k = k
+        self.queued = {obj: count for obj, count, lowest, highest in counts if self.responsible(count, lowest, highest)}
+        return True
+
+    # objects needing action as (UUID:HASH, count), most urgent first:
+    # under-replicated before over-replicated, and fewer copies before more
+    def pending(self):
+        return sorted(self.queued.items(), key=lambda item: (item[1] > self.k, item[1]))
@@ -0,0 +1,105 @@
+#!/bin/usr/env python3
+
+# John Sullivan (jsulli28), Jozef Porubcin (jporubci)
+# repair.py
+
+import asyncio
+import itertools
+import time
+
+# Outbound bandwidth budget shared by everything that takes from it.
+#
+# Callers take the bytes they're about to send. Tokens are allowed to go negative, so a big file goes out right
+# away and the next caller waits until the debt is paid back at rate bytes/s.
+class TokenBucket:
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = None # made on first use so it's bound to the running loop
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    async def take(self, amount):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        # one at a time, so waiters are served in order
+        async with self.lock:
+            self.refill()
+            if self.tokens < 0:
+                await asyncio.sleep(-self.tokens / self.rate)
+                self.refill()
+            self.tokens -= amount
+
+# Pool of workers running repairs in priority order (lowest first).
+#
+# An object is only queued once at a time, and isn't queued again for holdoff seconds after its repair finishes,
+# so gossip has a chance to confirm the new pin before we decide it still needs another.
+class RepairScheduler:
+
+    def __init__(self, repair, concurrency, holdoff):
+        self.repair = repair # coroutine function taking a UUID:HASH
+        self.concurrency = concurrency
+        self.holdoff = holdoff
+
+        self.queue = None
+        self.workers = []
+        self.counter = itertools.count() # tie breaker so objects themselves are never compared
+
+        self.queued = set()
+        self.recent = {} # UUID:HASH -> when its last repair finished
+
+        self.completed = 0
+        self.failed = 0
+
+    def __len__(self):
+        return len(self.queued)
+
+    # start workers, must be called from the running loop
+    def start(self):
+        self.queue = asyncio.PriorityQueue()
+        self.workers = [asyncio.ensure_future(self.worker()) for _ in range(self.concurrency)]
+
+    def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+
+    # queue a repair, returning whether it was queued
+    def submit(self, obj, priority):
+        if self.queue is None or obj in self.queued:
+            return False
+        if time.monotonic() - self.recent.get(obj, float('-inf')) < self.holdoff:
+            return False
+
+        self.queued.add(obj)
+        self.queue.put_nowait((priority, next(self.counter), obj))
+        return True
+
+    # forget repairs that finished longer ago than the holdoff
+    def prune(self):
+        cutoff = time.monotonic() - self.holdoff
+        for obj in [obj for obj, when in self.recent.items() if when < cutoff]:
+            del self.recent[obj]
+
+    async def worker(self):
+        while True:
+            _, _, obj = await self.queue.get()
+            try:
+                await self.repair(obj)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.failed += 1
+                print(f'error: repair: repairing {obj} failed: {err}')
+            finally:
+                self.queued.discard(obj)
+                self.recent[obj] = time.monotonic()
+                self.queue.task_done()
@@ -6,13 +6,23 @@
 import asyncio, aiohttp
 from aiohttp import web
 import socket # need constants
-import uuid, json, os, time, collections, shutil, random, math
-import copy
+import uuid, json, os, time, collections, random, math, hashlib
+import itertools
+import gc
 
 import sys
 import pprint # for debug
 
 import pin_funcs
+import chunk_funcs
+import gossip_funcs
+import worldview
+import planner
+import repair
+import storage
+import wal
+import snapshot
+import cache
 
 class sPinServer:
 
@@ -40,41 +50,127 @@ class sPinServer:
     # storage locations
     PIN_DIR = 'pinned_files'
     CACHE_DIR = 'cached_files'
+    CHUNK_DIR = 'chunked_files'
+    UPLOAD_DIR = 'uploading_files'
     META_DIR = 'meta'
     PIN_TRANS_BASE = 'pins'
     DEL_TRANS_BASE = 'dels'
+    WAL_BASE = 'wal'
+    SNAPSHOT_BASE = 'tables'
+    CACHE_INDEX_BASE = 'cache'
     NAME_BASE = 'name'
     # temp file extension
     TEMP_EXTENSION = 'new'
     CKPT_EXTENSION = 'ckpt'
+    SNAPSHOT_EXTENSION = 'snap'
+    INDEX_EXTENSION = 'json'
     LOG_EXTENSION = 'log'
+    PART_EXTENSION = 'part'
 
-    MAX_PIN_LOG_SIZE = 100
-    MAX_DEL_LOG_SIZE = 5_000 # 102 chars, ~5000 records
+    MAX_DELS = 100_000 # 102 chars, ~10MB of snapshot and an O(1) lookup per record
     MAX_CACHE_SIZE = 10_000_000_000 # 10GB
+    CACHE_SKETCH_WIDTH = 65_536 # counters in each row of the cache's popularity sketch, a power of two, around how many objects it can tell apart
+    MEMORY_TIER_SIZE = 256_000_000 # bytes of small objects kept in memory to answer GETs from
+    MEMORY_OBJECT_MAX = 64 * 1024 # objects at most this big are kept in memory once they've been read
+    STREAM_CHUNK_SIZE = 256 * 1024 # bytes per chunk when streaming objects between peers
+
+    # outbound connection pool constants
+    PEER_CONN_LIMIT = 100 # total connections open to other peers at once
+    PEER_CONN_LIMIT_PER_HOST = 8
+    PEER_KEEPALIVE = NAMESERVER_WAIT * 2 # long enough to keep connections across broadcast rounds
+    PEER_TIMEOUT = 5 # for small control messages
+    PEER_UPLOAD_TIMEOUT = 30 # for pushing whole files, on top of the time the size allows at PEER_UPLOAD_RATE
+    PEER_UPLOAD_RATE = 1_000_000 # bytes/s a push can slow to before it's given up on
+    BROADCAST_CONCURRENCY = 16 # peers posted to at once during a broadcast round
+
+    # repair constants
+    REPAIR_CONCURRENCY = 4 # objects being re-replicated at once
+    REPAIR_BANDWIDTH = 50_000_000 # bytes/s of outbound repair traffic, averaged
+    REPAIR_BURST = 100_000_000 # bytes of repair traffic that can go out before the budget kicks in
+    REPAIR_HOLDOFF = NAMESERVER_WAIT * 2 # don't repair the same object again until gossip has had time to confirm the last one
+
+    # gossip constants
+    GOSSIP_DELTA_WINDOW = 10_000 # pin changes kept for deltas, peers further behind than this get a full snapshot
+    GOSSIP_COMPRESS_MIN = 64 * 1024 # compress binary gossip bodies at least this big, None to never compress
+    MAX_BODY_SIZE = 256 * 1024 * 1024 # largest request body read whole, a snapshot is 48 bytes a pin in binary and 105 as JSON, so this is a couple million pins
+
+    # chunk store
+    CHUNK_ORPHAN_AGE = 2 * MAINTAIN_INTERVAL # chunks no pinned manifest uses are removed after going this long without being sent or asked about, so a manifest has time to follow its chunks
+
+    # write-ahead log for pins and deletions
+    WAL_BATCH_MAX = 1024 # most records made durable by one fsync
+    WAL_BATCH_DELAY = 0.002 # seconds a record waits for others to share its fsync, 0 to only batch what piles up during the last one
+    WAL_CHECKPOINT_RECORDS = 100_000 # records logged before the tables are snapshotted and the log before them removed, a snapshot writes every pin so this keeps them rare
+
+    # disk I/O
+    DISK_WORKERS = 4 # threads doing disk I/O for the loop, so that's as many files as are written to at once
+    LOOP_PROBE_INTERVAL = 0.1 # seconds between checks of how late the loop is running
+
+    # resumable uploads
+    UPLOAD_SESSION_AGE = 24 * 60 * 60 # partial uploads untouched for a day are given up on
 
     def __init__(self):
 
+        started = time.monotonic()
+
+        # disk I/O pool, so reads, writes and fsyncs don't hold up the loop
+        self.disk = storage.Storage(self.DISK_WORKERS)
+
         # load or make new name
         self.name = self.get_name()
+
+        # write-ahead log for changes to the pins and deletion tables, started in serve
+        self.wal = wal.WriteAheadLog(f'{self.META_DIR}/{self.WAL_BASE}', self.disk, self.WAL_BATCH_MAX, self.WAL_BATCH_DELAY, self.WAL_CHECKPOINT_RECORDS, self.checkpoint)
         
         # $UUID-$HASH table
         # UUID:HASH to HASH table
-        self.pins = self.load_pins()
+        # load_tables also builds self.pin_hashes, the reverse HASH -> set of UUID:HASH index, kept in step by pin_object/unpin_object
+        # and self.table_stats, how big the tables are and how long they take to load and snapshot
+        # it also leaves self.manifest_hints, the pinned hashes load_chunks should check for manifests (None for all of them),
+        # and self.legacy, files from before snapshots still to be folded into one
+        # deletion table
+        # UUID:HASH -> None, a dict so lookups are O(1) and insertion order still lets us drop the oldest half when the size gets too big
+        self.pins, self.dels = self.load_tables()
+        self.sweep_pins()
+
+        # chunk store
+        # chunks: set of HASH held in CHUNK_DIR
+        # chunk_refs: HASH -> number of manifests pinned here that list it
+        # manifests: HASH -> chunk HASHes, for each pinned manifest
+        # chunk_orphans: HASH -> when it last arrived or was asked about, for chunks no pinned manifest lists
+        self.load_chunks()
+
+        # now the manifests are known, anything from before snapshots can be folded into one
+        if self.legacy:
+            self.fold_legacy()
+
+        # resumable upload sessions
+        # uploads: UUID:HASH -> when its partial file was last added to
+        # uploads_busy: UUID:HASH being appended to or completed right now, only one request at a time gets to touch the file
+        self.load_uploads()
+        self.uploads_busy = set()
 
         # cache table
-        # same as pins basically
-        self.cache = {}
-        shutil.rmtree(self.CACHE_DIR)
-        os.mkdir(self.CACHE_DIR)
+        # cache.ObjectCache of HASH -> [size, last used], so membership is already the refcount for cached content
+        # it decides what gets in and what's evicted to make room, keeping the cache under MAX_CACHE_SIZE
+        # kept from run to run, with cache_unchecked: HASH -> None, or the check running on it, for content found at
+        # startup that hasn't been checked against its hash yet
+        self.load_cache()
 
-        # deletion table
-        # just a list of UUID:HASHes - this makes dropping the back end easier when the size gets too big
-        self.dels = self.load_dels()
+        # small objects answered from memory, filled as they're read
+        # HASH -> (body, headers), for content that's pinned or cached here
+        self.memory = cache.MemoryTier(self.MEMORY_TIER_SIZE, self.MEMORY_OBJECT_MAX, self.CACHE_SKETCH_WIDTH)
 
         # worldview table
-        # records should look like: UUID:HASH -> [{node: xyz, lastheardfrom: 123}, ... ]
-        self.world = collections.defaultdict(list)
+        # records look like: UUID:HASH -> {node uuid: lastheardfrom}, upserted as gossip arrives and expired oldest first
+        self.world = worldview.WorldView(on_change=self.plan_object)
+
+        # replication planner - objects we pin whose known replica count isn't k, kept up to date as the worldview changes
+        self.planner = planner.ReplicationPlanner()
+
+        # repair workers, started in serve, and the outbound budget they share
+        self.repairs = repair.RepairScheduler(self.repair_object, self.REPAIR_CONCURRENCY, self.REPAIR_HOLDOFF)
+        self.repair_budget = repair.TokenBucket(self.REPAIR_BANDWIDTH, self.REPAIR_BURST)
 
         # peers table - to be initialized at first run of retrieve
         # records should look like: node uuid -> {host: , port: , lastheardfrom (? MAYBE ?)}
@@ -85,174 +181,519 @@ class sPinServer:
         # host - same as above
         self.host = None
 
-    # log a deletion
-    # compress if necessary
-    def log_del(self, object_id):
+        # outbound session - shared by all traffic to peers and nameserver, made in serve
+        self.session = None
 
-        log_location = f'{self.META_DIR}/{self.DEL_TRANS_BASE}.{self.LOG_EXTENSION}'
+        # timing/result stats for the last broadcast round
+        self.broadcast_stats = {}
 
-        if self.del_log_length > self.MAX_DEL_LOG_SIZE:
-            # get from half to the end
-            new_dels = self.dels[self.del_log_length // 2:]
+        # how late the loop has been getting to things, in seconds
+        self.loop_stats = {'lag_last_s': 0.0, 'lag_avg_s': 0.0, 'lag_max_s': 0.0}
 
-            new_log_location = f'{self.META_DIR}/{self.DEL_TRANS_BASE}.{self.LOG_EXTENSION}.{self.TEMP_EXTENSION}'
+        # deletion notices that haven't got through yet: (node uuid, UUID:HASH) -> None, or the task sending it
+        # sent in the background so nobody waits on a slow or dead peer, and sent again by maintain until they're taken
+        self.del_notices = {}
 
-            # open and write to new log
-            with open(new_log_location, 'w') as new_log:
-                new_log.writelines([f'{obj_id}\n' for obj_id in new_dels])
-                new_log.flush()
-                os.fsync(new_log.fileno())
+        # GET misses being fetched from peers right now: HASH -> future resolved when the fetch is over
+        self.inflight = {}
 
-            # close old log
-            self.del_log.close()
+        # pin change sequence for delta gossip
+        # epoch changes every run so peers know to throw away what they had from us and take a snapshot
+        # changes look like: (seq, ADD/DEL, UUID:HASH)
+        self.gossip_epoch = str(uuid.uuid4())
+        self.pin_seq = 0
+        self.pin_changes = collections.deque(maxlen=self.GOSSIP_DELTA_WINDOW)
 
-            # replace with new
-            os.replace(new_log_location, log_location)
+        # what each peer has told us it holds from us: node uuid -> (epoch, seq)
+        self.gossip_acks = {}
 
-            # open again
-            self.del_log = open(log_location, 'a')
+        # whether each peer has said it takes binary gossip: node uuid -> bool
+        self.gossip_formats = {}
 
-            # set dels to new_dels
-            self.dels = new_dels
-            self.del_log_length = len(self.dels)
+        # what we know each peer pins: node uuid -> {epoch: , seq: , objects: set of UUID:HASH}
+        self.gossip_state = {}
 
+        # how long startup took, which is mostly loading the tables
+        self.table_stats['startup_s'] = round(time.monotonic() - started, 3)
+        print(f'info: __init__: started in {self.table_stats["startup_s"]:.2f}s')
+
+    # log a deletion
+    # callers add to the deletion table first, then wait on this to know the deletion is durable
+    async def log_del(self, object_id):
+
+        # keep the table bounded by dropping the oldest half, checkpointing so that sticks
+        if len(self.dels) > self.MAX_DELS:
+            self.dels = dict.fromkeys(itertools.islice(self.dels, len(self.dels) // 2, None))
+            self.wal.request_checkpoint()
             print('info: log_del: truncated deletes')
 
         try:
-            self.del_log.write(object_id + '\n')
-            self.del_log.flush()
-            os.fsync(self.del_log.fileno())
-            self.del_log_length += 1
+            await self.wal.append(f'TOMB:{object_id}')
             return True
         except OSError:
-            print('error: log_del: could not add to deletion log')
+            print('error: log_del: could not add to write-ahead log')
             return False
-        
-    # load deletions from disk
-    def load_dels(self):
 
-        log_location = f'{self.META_DIR}/{self.DEL_TRANS_BASE}.{self.LOG_EXTENSION}'
+    # log a pin transaction
+    # callers update the pins table first, then wait on this to know the change is durable
+    # records go into the write-ahead log in the order they were made, so the log, the table and gossip all agree on order
+    async def log_pins(self, type, object_id):
+
+        # lowercase type
+        type = type.lower()
+
+        # record change for gossip
+        self.pin_seq += 1
+        self.pin_changes.append((self.pin_seq, 'ADD' if type == 'add' else 'DEL', object_id))
+
+        if type == 'add':
+            record = f'ADD:{object_id}'
+        else:
+            record = f'DEL:{object_id}'
 
-        # attempt to load from log location into dels
         try:
-            with open(log_location, 'r') as del_log:
-                dels = [line.strip() for line in del_log]
+            await self.wal.append(record)
+            return True
         except OSError:
-            print('error: could not load old deletion log')
-            dels = []
+            print('error: log_pins: could not add to write-ahead log')
+            return False
 
-        # open log location for appends
-        self.del_log = open(log_location, 'a')
-        self.del_log_length = len(dels)
+    # snapshot the pins and deletion tables as of the start of a write-ahead log segment
+    # run by the write-ahead log once it's moved on to that segment, in the background while it carries on logging
+    async def checkpoint(self, segment):
 
-        return dels
-    
-    # log a pin transaction
-    # compress checkpoint if needed
-    def log_pins(self, type, object_id):
+        # copied once the log has moved on, so anything the copies miss is in segment or later
+        # only the ids are copied, which is quick even with millions of pins, and the disk pool writes them out
+        pins = list(self.pins)
+        dels = list(self.dels)
+        manifests = list(self.manifests)
 
-        # lowercase type
-        type = type.lower()
+        start = time.monotonic()
+        await self.disk.run(self.write_snapshot, segment, pins, dels, manifests)
+        elapsed = time.monotonic() - start
 
-        log_location = f'{self.META_DIR}/{self.PIN_TRANS_BASE}.{self.LOG_EXTENSION}'
-        ckpt_location = f'{self.META_DIR}/{self.PIN_TRANS_BASE}.{self.CKPT_EXTENSION}'
+        self.table_stats['snapshot_pins'] = len(pins)
+        self.table_stats['snapshot_s'] = round(elapsed, 3)
+        print(f'info: checkpoint: saved {len(pins)} pins and {len(dels)} deletions in {elapsed:.2f}s')
 
-        if self.pin_log_length > self.MAX_PIN_LOG_SIZE:
+    # write a snapshot of the tables as of the start of segment, for the disk pool
+    def write_snapshot(self, segment, pins, dels, manifests):
+        location = f'{self.META_DIR}/{self.SNAPSHOT_BASE}.{self.SNAPSHOT_EXTENSION}'
+        snapshot.write(location, f'{location}.{self.TEMP_EXTENSION}', segment, pins, dels, manifests)
 
-            # write out full pins to new ckpt
-            with open(f'{ckpt_location}.{self.TEMP_EXTENSION}', 'w') as new_ckpt:
-                to_write = json.dumps(self.pins)
-                new_ckpt.write(to_write)
-                new_ckpt.flush()
-                os.fsync(new_ckpt.fileno())
+    # load pins and deletions from the snapshot, then replay the write-ahead log since then over them
+    # replaying records the snapshot already has is harmless, as each leaves the tables the way they were
+    def load_tables(self):
 
-            os.replace(f'{ckpt_location}.{self.TEMP_EXTENSION}', ckpt_location)
+        location = f'{self.META_DIR}/{self.SNAPSHOT_BASE}.{self.SNAPSHOT_EXTENSION}'
+        start = time.monotonic()
+
+        # the tables are millions of objects made all at once, so keep the garbage collector from walking
+        # everything built so far over and over while they're made
+        gc.disable()
+        try:
+            loaded = snapshot.read(location)
+            if loaded is None:
+                segment, pins, dels = 0, {}, {}
+                self.manifest_hints = None
+            else:
+                segment, pin_ids, del_ids, manifest_hashes = loaded
+                pins = {object_id: object_id.split(':')[1] for object_id in pin_ids}
+                dels = dict.fromkeys(del_ids)
+                self.manifest_hints = set(manifest_hashes)
+
+            # files from before snapshots, which come before anything in the write-ahead log
+            # folded into a snapshot once the manifests are known too, see fold_legacy
+            self.legacy = self.load_legacy(pins, dels)
+            if self.legacy:
+                self.manifest_hints = None
+
+            for record in self.wal.replay(segment):
+                added = self.apply_record(pins, dels, record)
+                if added and self.manifest_hints is not None:
+                    self.manifest_hints.add(added)
+
+            # build reverse index
+            self.pin_hashes = collections.defaultdict(set)
+            for identifier, hash in pins.items():
+                self.pin_hashes[hash].add(identifier)
+        finally:
+            gc.enable()
+
+        elapsed = time.monotonic() - start
+        self.table_stats = {'pins': len(pins), 'load_s': round(elapsed, 3), 'snapshot_pins': 0, 'snapshot_s': 0.0}
+        print(f'info: load_tables: loaded {len(pins)} pins and {len(dels)} deletions in {elapsed:.2f}s')
+
+        return pins, dels
+
+    # apply a write-ahead log record to the tables, returning the hash it pinned if it's an ADD
+    def apply_record(self, pins, dels, record):
+
+        type, _, object_id = record.partition(':')
+        if object_id.count(':') != 1:
+            print(f'error: apply_record: skipping broken record {record}')
+            return None
+
+        if type == 'ADD':
+            pins[object_id] = object_id.split(':')[1]
+            return pins[object_id]
+        elif type == 'DEL':
+            pins.pop(object_id, None)
+        else: # TOMB
+            dels[object_id] = None
+        return None
+
+    # fold the files load_legacy found into a snapshot, so they can go
+    def fold_legacy(self):
+
+        self.write_snapshot(self.wal.segment, list(self.pins), list(self.dels), list(self.manifests))
+        for location in self.legacy:
+            os.remove(location)
+        print(f'info: fold_legacy: moved {len(self.legacy)} old files into a snapshot')
+        self.legacy = []
+
+    # apply whichever of the tables' files from before snapshots are still around, returning their locations
+    # that's pins.ckpt and dels.ckpt, then pins.log and dels.log, then wal.log, oldest first
+    def load_legacy(self, pins, dels):
+
+        legacy = []
 
-            self.pin_log.truncate(0)
-            self.pin_log.seek(0)
-            self.pin_log_length = 0
+        try:
+            location = f'{self.META_DIR}/{self.PIN_TRANS_BASE}.{self.CKPT_EXTENSION}'
+            with open(location, 'r') as ckpt:
+                pins.update(json.loads(ckpt.read()))
+            legacy.append(location)
+        except FileNotFoundError:
+            pass
+
+        for base in [f'{self.DEL_TRANS_BASE}.{self.CKPT_EXTENSION}', f'{self.DEL_TRANS_BASE}.{self.LOG_EXTENSION}']:
+            try:
+                location = f'{self.META_DIR}/{base}'
+                with open(location, 'r') as log:
+                    dels.update(dict.fromkeys(line.strip() for line in log if line.strip()))
+                legacy.append(location)
+            except FileNotFoundError:
+                pass
 
-            print('info: log_pins: compressed pin log to checkpoint')
+        try:
+            location = f'{self.META_DIR}/{self.PIN_TRANS_BASE}.{self.LOG_EXTENSION}'
+            with open(location, 'r') as log:
+                for line in log:
+                    elements = line.strip().split(':')
+                    if elements[0] == 'ADD':
+                        pins[f'{elements[1]}:{elements[2]}'] = elements[2]
+                    elif elements[0] == 'DEL':
+                        pins.pop(f'{elements[1]}:{elements[2]}', None)
+            legacy.append(location)
+        except FileNotFoundError:
+            pass
 
-        if type == 'add':
-            log_line = f'ADD:{object_id}\n'
+        try:
+            location = f'{self.META_DIR}/{self.WAL_BASE}.{self.LOG_EXTENSION}'
+            with open(location, 'r') as log:
+                for line in log:
+                    if line.endswith('\n'):
+                        self.apply_record(pins, dels, line.strip())
+            legacy.append(location)
+        except FileNotFoundError:
+            pass
+
+        return legacy
+
+    # build the chunk tables from the chunk store and pinned manifests
+    def load_chunks(self):
+
+        os.makedirs(self.CHUNK_DIR, exist_ok=True)
+
+        self.chunks = set()
+        self.chunk_refs = collections.Counter()
+        self.manifests = {}
+        self.chunk_orphans = {}
+
+        for filename in os.listdir(self.CHUNK_DIR):
+            if filename.endswith(f'.{self.TEMP_EXTENSION}'):
+                os.unlink(f'{self.CHUNK_DIR}/{filename}') # never finished arriving
+            else:
+                self.chunks.add(filename)
+
+        # only what the snapshot says were manifests, and what's been pinned since, needs looking at
+        # without a snapshot, every pinned object does
+        if self.manifest_hints is None:
+            candidates = list(self.pin_hashes)
         else:
-            log_line = f'DEL:{object_id}\n'
+            candidates = [hash for hash in self.manifest_hints if hash in self.pin_hashes]
+        self.manifest_hints = None
+
+        for hash in candidates:
+            self.add_manifest(hash)
+
+        now = time.time()
+        for hash in self.chunks:
+            if not self.chunk_refs.get(hash):
+                self.chunk_orphans[hash] = now
+
+    # if the content pinned for hash is a manifest, take a reference on each of its chunks
+    def add_manifest(self, hash):
 
         try:
-            self.pin_log.write(log_line)
-            self.pin_log.flush()
-            os.fsync(self.pin_log.fileno())
-            self.pin_log_length += 1
-            return True
+            chunks = chunk_funcs.read_manifest(f'{self.PIN_DIR}/{hash}')
         except OSError:
-            print('error: log_pins: could not add to pin log')
-            return False
-        
-    # load pins from checkpoint and log
-    def load_pins(self):
+            return
+        if chunks is None:
+            return
+
+        self.manifests[hash] = chunks
+        for chunk in chunks:
+            if chunk not in self.chunks:
+                print(f'error: add_manifest: manifest {hash} lists chunk {chunk}, which is missing')
+            self.chunk_refs[chunk] += 1
+            self.chunk_orphans.pop(chunk, None)
+
+    # drop a manifest's references on its chunks
+    # any nothing else uses are left as orphans for clean_chunks, since a client may have just been told we have them
+    def release_manifest(self, hash):
+
+        now = time.time()
+        for chunk in self.manifests.pop(hash, ()):
+            self.chunk_refs[chunk] -= 1
+            if self.chunk_refs[chunk] <= 0:
+                del self.chunk_refs[chunk]
+                self.chunk_orphans[chunk] = now
+
+    def remove_chunk(self, hash):
+        self.chunks.discard(hash)
+        self.chunk_orphans.pop(hash, None)
+        if not self.discard(f'{self.CHUNK_DIR}/{hash}'):
+            print(f'info: remove_chunk: {hash} not found to delete from chunks')
+
+    # find partial uploads left from before
+    def load_uploads(self):
+
+        os.makedirs(self.UPLOAD_DIR, exist_ok=True)
+
+        self.uploads = {}
+        for filename in os.listdir(self.UPLOAD_DIR):
+            if filename.endswith(f'.{self.PART_EXTENSION}'):
+                identifier = filename[:-len(self.PART_EXTENSION) - 1].replace('.', ':')
+                self.uploads[identifier] = os.stat(f'{self.UPLOAD_DIR}/{filename}').st_mtime
+            elif filename.endswith(f'.{self.TEMP_EXTENSION}'):
+                os.unlink(f'{self.UPLOAD_DIR}/{filename}') # was on its way out
+
+    # remove temp files left in the pins dir, content that never finished arriving or was on its way out
+    def sweep_pins(self):
+
+        os.makedirs(self.PIN_DIR, exist_ok=True)
+
+        for filename in os.listdir(self.PIN_DIR):
+            if filename.endswith(f'.{self.TEMP_EXTENSION}'):
+                os.unlink(f'{self.PIN_DIR}/{filename}')
+
+    # where the partial file for an upload session lives
+    def upload_location(self, identifier):
+        return f'''{self.UPLOAD_DIR}/{identifier.replace(':', '.')}.{self.PART_EXTENSION}'''
+
+    # how many bytes of an upload session are committed to disk
+    def upload_offset(self, identifier):
+        try:
+            return os.stat(self.upload_location(identifier)).st_size
+        except FileNotFoundError:
+            return 0
 
-        log_location = f'{self.META_DIR}/{self.PIN_TRANS_BASE}.{self.LOG_EXTENSION}'
-        ckpt_location = f'{self.META_DIR}/{self.PIN_TRANS_BASE}.{self.CKPT_EXTENSION}'
+    # give up on an upload session
+    def drop_upload(self, identifier):
+        self.uploads.pop(identifier, None)
+        self.discard(self.upload_location(identifier))
 
-        # attempt to load checkpoint
+    # rebuild the cache table from what's in the cache dir, in the order it was last used
+    def load_cache(self):
+
+        os.makedirs(self.CACHE_DIR, exist_ok=True)
+
+        self.cache = cache.ObjectCache(self.MAX_CACHE_SIZE, self.CACHE_SKETCH_WIDTH)
+        self.cache_unchecked = {}
+
+        # when each was last used, and how often it had been asked for, as of the last time the index was saved
+        # indexes saved before frequencies were kept count each entry as asked for once
+        location = f'{self.META_DIR}/{self.CACHE_INDEX_BASE}.{self.INDEX_EXTENSION}'
         try:
-            ckpt = open(ckpt_location, 'r')
-            ckpt_present = True
-        except OSError:
-            with open(ckpt_location, 'w') as new_ckpt:
-                new_ckpt.write('{}\n')
-                new_ckpt.flush()
-                os.fsync(new_ckpt.fileno())
-            ckpt_present = False
+            with open(location, 'r') as index:
+                indexed = {hash: (used, frequency[0] if frequency else 1) for hash, _, used, *frequency in json.load(index)}
+        except FileNotFoundError:
+            indexed = {}
+        except ValueError:
+            print('error: load_cache: could not read cache index, going by file times')
+            indexed = {}
+
+        found = []
+        for filename in os.listdir(self.CACHE_DIR):
+            if filename.endswith(f'.{self.TEMP_EXTENSION}'):
+                os.unlink(f'{self.CACHE_DIR}/{filename}') # never finished arriving, or was on its way out
+            elif chunk_funcs.is_hash(filename):
+                stat = os.stat(f'{self.CACHE_DIR}/{filename}')
+                # anything cached since the index was saved was last used about when it arrived, and asked for once
+                used, frequency = indexed.get(filename, (stat.st_mtime, 1))
+                found.append((used, filename, stat.st_size, frequency))
+
+        for used, hash, size, frequency in sorted(found):
+            self.cache.load(hash, size, used, frequency)
+            self.cache_unchecked[hash] = None
+
+        # in case MAX_CACHE_SIZE has come down since
+        for hash in self.cache.trim():
+            self.cache_unchecked.pop(hash, None)
+            os.unlink(f'{self.CACHE_DIR}/{hash}')
+
+        print(f'info: load_cache: found {len(self.cache)} cached objects')
+
+    # save when each cached object was last used and how often it's asked for, so both survive a restart
+    async def save_cache_index(self):
+
+        location = f'{self.META_DIR}/{self.CACHE_INDEX_BASE}.{self.INDEX_EXTENSION}'
+        index = json.dumps([[hash, size, used, self.cache.frequency(hash)] for hash, (size, used) in self.cache.items()])
+
+        try:
+            await self.disk.run(storage.replace_file, location, f'{location}.{self.TEMP_EXTENSION}', index)
+        except OSError as os_err:
+            print(f'error: save_cache_index: could not save cache index: {os_err}')
+
+    # whether hash is cached, marking it used if so
+    # content found at startup is checked against its hash the first time it's asked for, rather than all of it at once
+    async def cache_hit(self, hash):
+
+        if hash in self.cache_unchecked:
+            check = self.cache_unchecked[hash]
+            if check is None:
+                check = asyncio.ensure_future(self.check_cached(hash))
+                self.cache_unchecked[hash] = check
+            await asyncio.shield(check)
+
+        return self.cache.lookup(hash)
+
+    # hash a cached file found at startup, dropping it if it doesn't match
+    async def check_cached(self, hash):
 
-        # attempt to load log
         try:
-            log = open(log_location, mode='r')
-            log_present = True
+            good = await self.disk.digest(f'{self.CACHE_DIR}/{hash}') == hash
         except OSError:
-            log_present = False
+            good = False
 
-        # check if ckpt newer
-        if (ckpt_present and log_present) and (os.stat(ckpt.fileno()).st_mtime_ns > os.stat(log.fileno()).st_mtime_ns):
-            ckpt_newer = True
-        else:
-            ckpt_newer = False
+        # only if it's still the same entry, it may have been removed or cached again meanwhile
+        if hash not in self.cache_unchecked:
+            return
+        del self.cache_unchecked[hash]
+
+        if not good:
+            print(f'error: check_cached: cached {hash} did not match its hash, removing it')
+            self.uncache(hash)
+            self.discard(f'{self.CACHE_DIR}/{hash}')
+
+    # offer content that's just been fetched to the cache, returning whether it was let in
+    # whatever's evicted to make room is removed here, the caller moves the content into place if it got in
+    def add_cached(self, hash, size):
+
+        admitted, evicted = self.cache.admit(hash, size)
+
+        for old in evicted:
+            self.cache_unchecked.pop(old, None)
+            if not self.pin_hashes.get(old):
+                self.memory.remove(old)
+            if self.discard(f'{self.CACHE_DIR}/{old}'):
+                print(f'info: add_cached: evicted {old} from cache')
+
+        if admitted:
+            self.cache_unchecked.pop(hash, None)
+        return admitted
+
+    # drop hash from the cache table, the caller removes the file
+    def uncache(self, hash):
+        self.cache_unchecked.pop(hash, None)
+        self.cache.remove(hash)
+
+    # remove a file without waiting on the disk
+    # it's renamed out of the way here, which is quick, so nothing can find it or be written over by the slow part done on the disk pool
+    # returns whether it was there
+    def discard(self, path):
+        trash = f'{path}.{uuid.uuid4().hex}.{self.TEMP_EXTENSION}'
+        try:
+            os.rename(path, trash)
+        except FileNotFoundError:
+            return False
+        self.disk.run_soon(storage.remove_file, trash)
+        return True
 
-        self.pin_log_length = 0
+    # chunks listed by the manifest at path that aren't in the chunk store, empty if it isn't a manifest
+    def missing_chunks(self, path):
+        return [chunk for chunk in chunk_funcs.read_manifest(path) or () if chunk not in self.chunks]
 
-        # if no ckpt, make an empty table
-        if not ckpt_present:
-            pins = {}
-        else:
-            pins = json.loads(ckpt.read())
+    # whether newly received content for identifier can be pinned
+    # a manifest can't be until every chunk it lists is here, so its file is removed and False returned
+    def manifest_ready(self, identifier, hash):
 
-            # if checkpoint older than txn, replay
-            if not ckpt_newer and log_present:
-                for line in log:
-                    self.pin_log_length += 1
+        if self.pin_hashes.get(hash):
+            return True # already pinned, so already complete
 
-                    line = line.strip()
-                    elements = line.split(':')
+        try:
+            missing = self.missing_chunks(f'{self.PIN_DIR}/{hash}')
+        except OSError:
+            return True # nothing there to check
+        if not missing:
+            return True
 
-                    if elements[0] == 'ADD':
-                        pins[f'{elements[1]}:{elements[2]}'] = elements[2]
-                    else: # DEL
-                        try:
-                            del pins[f'{elements[1]}:{elements[2]}']
-                        except KeyError:
-                            pass
+        print(f'error: manifest_ready: {identifier} is a manifest missing {len(missing)} chunks, not pinning')
+        self.discard(f'{self.PIN_DIR}/{hash}')
+        return False
 
-        # clean up
-        if ckpt_present:
-            ckpt.close()
-        if log_present:
-            log.close()
+    # add to pins table and reverse index
+    def pin_object(self, identifier, hash):
+        first = not self.pin_hashes.get(hash)
+        self.pins[identifier] = hash
+        self.pin_hashes[hash].add(identifier)
+        if first:
+            self.add_manifest(hash)
+        self.plan_object(identifier)
+
+    # pin an object and log it, returning whether that's durable
+    # if the log couldn't be written the pin is undone, along with its file if nothing else pins the content
+    async def pin_logged(self, identifier, hash):
+        self.pin_object(identifier, hash)
+        if await self.log_pins('ADD', identifier):
+            return True
 
-        # open log for appending
-        self.pin_log = open(log_location, 'a')
+        self.undo_pins('ADD', identifier, hash)
+        if not self.pin_hashes.get(hash):
+            self.discard(f'{self.PIN_DIR}/{hash}')
+        return False
 
-        return pins
+    # put back a pins table change whose record couldn't be logged, so it isn't kept without being durable
+    # gossip may have sent the change already, so the reverse goes out the same way
+    def undo_pins(self, type, identifier, hash):
+        if type == 'ADD':
+            self.unpin_object(identifier)
+        else:
+            self.pin_object(identifier, hash)
+        self.pin_seq += 1
+        self.pin_changes.append((self.pin_seq, 'DEL' if type == 'ADD' else 'ADD', identifier))
+
+    # remove from pins table and reverse index
+    def unpin_object(self, identifier):
+        hash = self.pins.pop(identifier, None)
+        if hash is None:
+            return # already gone, e.g. two deletions raced
+        refs = self.pin_hashes[hash]
+        refs.discard(identifier)
+        if not refs:
+            del self.pin_hashes[hash]
+            self.release_manifest(hash)
+        self.plan_object(identifier)
+
+    # let the planner know an object's replica count may have changed
+    def plan_object(self, obj):
+        self.planner.update(obj, obj in self.pins, *self.replicas(obj))
+
+    # (other nodes known to pin obj, whether we're the lowest named of its pins, whether we're the highest)
+    def replicas(self, obj):
+        others = self.world.get(obj) or {}
+        return len(others), self.name <= min(others, default=self.name), self.name >= max(others, default=self.name)
 
     def get_name(self):
         # track whether we need to write out
@@ -323,9 +764,8 @@ class sPinServer:
             print('info: retrieve_peers: refreshing peer info from nameserver')
 
             # async retrieval of the JSON
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f'http://{self.NAMESERVER_NAME}:{self.NAMESERVER_PORT}{self.NAMESERVER_URL}') as resp:
-                    nameserver_json = await resp.json(content_type=None) # disable content type check, nameserver gives text even though it's json
+            async with self.session.get(f'http://{self.NAMESERVER_NAME}:{self.NAMESERVER_PORT}{self.NAMESERVER_URL}') as resp:
+                nameserver_json = await resp.json(content_type=None) # disable content type check, nameserver gives text even though it's json
 
             # find our project in nameserver json response
             now = time.time()
@@ -348,12 +788,21 @@ class sPinServer:
             dedup = [max(dupes, key=lambda k: k['lastheardfrom']) for dupes in duplicates.values()]
 
             # set peers
-            self.peers = {record['uuid'] : record for record in dedup}
+            new_peers = {record['uuid'] : record for record in dedup}
+            departed = [node for node in self.peers if node not in new_peers]
+            self.peers = new_peers
                 
             if self.DBG:     
                 print('received following peers:')
                 pprint.pprint(self.peers)
 
+            # start repairing right away for anything that lost a pin, instead of waiting on maintain
+            if departed:
+                for node in departed:
+                    self.world.forget_node(node)
+                print(f'info: retrieve_peers: {len(departed)} peers went away, scheduling repairs')
+                self.schedule_repairs()
+
             # broadcast to all peers
             await self.broadcast(self.peers)
 
@@ -371,127 +820,218 @@ class sPinServer:
 
             print('info: maintain: beginning maintenance')
 
-            # remove anything too old from worldview
-            now = time.time()
-            new_world = collections.defaultdict(list)
-            for obj, known_pins in self.world.items():
-                non_stale = [
-                    pin for pin in known_pins 
-                        if (now - pin['lastheardfrom'] < self.WORLD_STALENESS)
-                            and self.peers.get(pin['node'])
-                    ]
-                new_world[obj] = non_stale
+            # remove anything too old from worldview, and anything from peers that have gone away
+            expired = self.world.expire(time.time() - self.WORLD_STALENESS)
+            for node in [node for node in self.world.nodes if not self.peers.get(node)]:
+                self.world.forget_node(node)
 
-            self.world = new_world
+            print(f'info: maintain: expired {expired} stale worldview records, {len(self.world)} remain')
+
+            # forget gossip state for peers that have gone away, they'll get/send a snapshot if they come back
+            for node in [node for node in self.gossip_state if not self.peers.get(node)]:
+                del self.gossip_state[node]
+            for node in [node for node in self.gossip_acks if not self.peers.get(node)]:
+                del self.gossip_acks[node]
+            for node in [node for node in self.gossip_formats if not self.peers.get(node)]:
+                del self.gossip_formats[node]
 
             print('info: maintain: updated worldview')
 
-            # calculate k
-            k = math.ceil(len(self.peers) / self.K_DENOM)
-
-            # deep copy world
-            local_world = copy.deepcopy(self.world)
-
-            # check for too many or too few pins
-            for obj, known_pins in local_world.items():
-
-                if self.pins.get(obj):
-                    count = len(known_pins)
-                    pins = [curr['node'] for curr in known_pins]
-                    pins.append(self.name)
-                    not_pins = [node for node in self.peers.keys() if node not in pins]
-
-                    if count > k:
-                        to_drop = pin_funcs.drop_pin(self.name, pins)
-                        if to_drop and self.peers.get(to_drop) and to_drop != self.name:
-                            node = self.peers[to_drop]
-                            #pprint.pprint(self.peers)
-                            name = f'''{node['name']}:{node['port']}'''
-                            print(f'info: maintain: instructing {name} to drop {obj}')
-                            await self.notify_drop(name, obj)
-
-                    if count < k:
-                        to_add = pin_funcs.add_pin(self.name, pins, not_pins)
-                        if to_add and self.peers.get(to_add) and to_add != self.name:
-                            node = self.peers[to_add]
-                            #pprint.pprint(self.peers)
-                            name = f'''{node['name']}:{node['port']}'''
-                            print(f'info: maintain: instructing {name} to pin {obj}')
-                            await self.notify_pin(name, obj)
-
-            print('info: maintain: verified pin counts')
-
-            # delete oldest files in cache if too large
-            self.clean_cache()
-            print('info: maintain: checked and cleaned cache as needed')
+            # send again whatever deletion notices didn't get through, to peers that are still around
+            for node, obj in [key for key, task in self.del_notices.items() if task is None]:
+                if self.peers.get(node):
+                    self.send_deletion(node, obj)
+                else:
+                    del self.del_notices[(node, obj)]
+
+            # queue up whatever needs re-replicating
+            self.schedule_repairs()
+            self.repairs.prune()
+
+            # save the cache's order for next time, it's kept under size as things are added
+            await self.save_cache_index()
+            print(f'''info: maintain: saved cache index, {len(self.cache)} objects and {self.cache.size} bytes cached''')
+
+            # drop chunks whose manifest never turned up
+            self.clean_chunks()
+
+            # max lag is since the last maintenance
+            print(f'''info: maintain: loop lag averaging {self.loop_stats['lag_avg_s']:.4f}s, at most {self.loop_stats['lag_max_s']:.4f}s''')
+            self.loop_stats['lag_max_s'] = 0.0
+
+            # drop uploads that were never finished
+            cutoff = time.time() - self.UPLOAD_SESSION_AGE
+            for identifier in [identifier for identifier, when in self.uploads.items() if when < cutoff and identifier not in self.uploads_busy]:
+                print(f'info: maintain: giving up on unfinished upload of {identifier}')
+                self.drop_upload(identifier)
 
             # wait the required amount of time
             await asyncio.sleep(self.MAINTAIN_INTERVAL)
 
-    # clean out oldest cache files until size is correct
-    def clean_cache(self):
+    # keep track of how late the loop is waking us up, which is how long anything else on it has been kept waiting
+    async def monitor_loop(self):
+
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.LOOP_PROBE_INTERVAL)
+            lag = time.monotonic() - start - self.LOOP_PROBE_INTERVAL
+
+            self.loop_stats['lag_last_s'] = lag
+            self.loop_stats['lag_avg_s'] = 0.9 * self.loop_stats['lag_avg_s'] + 0.1 * lag
+            self.loop_stats['lag_max_s'] = max(self.loop_stats['lag_max_s'], lag)
+
+    # queue repairs for every object the planner says has too many or too few pins
+    def schedule_repairs(self):
 
-        # get cached files, then stat them
-        cached_files = os.listdir(self.CACHE_DIR)
-        cached_stats = [os.stat(f'{self.CACHE_DIR}/{filename}') for filename in cached_files]
+        # calculate k, only re-planning everything if it changed
+        k = math.ceil(len(self.peers) / self.K_DENOM)
+        if self.planner.set_k(k, ((obj, *self.replicas(obj)) for obj in self.pins)):
+            print(f'info: schedule_repairs: k is now {k}, re-planned all pins')
 
-        # get total size of cache
-        cache_size = sum([s.st_size for s in cached_stats])
+        # most urgent first: fewest copies, and adding pins before dropping them
+        queued = 0
+        for obj, count in self.planner.pending():
+            if self.repairs.submit(obj, (count > k, count)):
+                queued += 1
 
-        # bail early if cache is okay
-        if cache_size < self.MAX_CACHE_SIZE:
+        print(f'info: schedule_repairs: {len(self.planner)} objects need replication changes, queued {queued}, {len(self.repairs)} waiting or in progress')
+
+    # fix the pin count for a single object, run by the repair workers
+    async def repair_object(self, obj):
+
+        # things may have moved on since this was queued
+        if not self.pins.get(obj):
             return
-        
-        # sort cache by oldest, figure out n oldest to remove to be at half of max size
-        target = self.MAX_CACHE_SIZE / 2
-        cache_combined = {filename: stat for filename, stat in zip(cached_files, cached_stats)}
-        cache_sorted = dict(sorted(cache_combined.items(), key=lambda k: k[1].st_mtime, reverse=True))
-        size_so_far = 0
-        to_delete = []
-        for filename, stat_result in cache_sorted.items():
-            if size_so_far > target:
-                break
-            size_so_far += stat_result.st_size
-            to_delete.append(filename)
-
-        # delete them
-        for file in to_delete:
-            try:
-                if self.cache.get(file): del self.cache[file]
-                os.unlink(f'{self.CACHE_DIR}/{file}')
-                print(f'info: clean_cache: removed {file} from cache')
-            except OSError:
-                print(f'error: clean_cache: failed to remove {file} from cache')
+
+        k = self.planner.k
+        known_pins = self.world.get(obj) or {}
+        count = len(known_pins)
+        pins = list(known_pins)
+        pins.append(self.name)
+        not_pins = [node for node in self.peers.keys() if node not in pins]
+
+        if count > k:
+            to_drop = pin_funcs.drop_pin(self.name, pins)
+            if to_drop and self.peers.get(to_drop) and to_drop != self.name:
+                node = self.peers[to_drop]
+                name = f'''{node['name']}:{node['port']}'''
+                print(f'info: repair: instructing {name} to drop {obj}')
+                await self.notify_drop(name, obj)
+
+        if count < k and not_pins:
+            to_add = pin_funcs.add_pin(self.name, pins, not_pins)
+            if to_add and self.peers.get(to_add) and to_add != self.name:
+                node = self.peers[to_add]
+                name = f'''{node['name']}:{node['port']}'''
+                print(f'info: repair: instructing {name} to pin {obj}')
+                await self.notify_pin(name, obj)
+
+    # remove chunks that have gone unused for CHUNK_ORPHAN_AGE
+    def clean_chunks(self):
+
+        cutoff = time.time() - self.CHUNK_ORPHAN_AGE
+        for hash in [hash for hash, when in self.chunk_orphans.items() if when < cutoff]:
+            if not self.chunk_refs.get(hash):
+                self.remove_chunk(hash)
+                print(f'info: clean_chunks: removed unused chunk {hash}')
 
     # broadcast information to other peers
     async def broadcast(self, peers):
 
         print(f'info: broadcast: broadcasting pins to peers')
 
-        # prep pins for sending
-        payload = [{'object': obj, 'node': self.name} for obj in self.pins]
+        if self.DBG: pprint.pprint(self.pins)
+
+        # encoded payloads for this round, shared by peers that are at the same seq
+        payloads = {}
+
+        # post to every peer at once, capped so a big cluster doesn't open everything together
+        limit = asyncio.Semaphore(self.BROADCAST_CONCURRENCY)
+        start = time.perf_counter()
+        results = await asyncio.gather(*[self.broadcast_to(limit, peer_name, peer_info, payloads) for peer_name, peer_info in peers.items()])
+        duration = time.perf_counter() - start
+
+        # keep stats for the round
+        self.broadcast_stats = {
+            'peers': len(results),
+            'succeeded': sum(1 for success, _, _ in results if success),
+            'round_s': duration,
+            'slowest_s': max([elapsed for _, elapsed, _ in results], default=0),
+            'bytes_sent': sum(sent for _, _, sent in results),
+            'snapshots': sum(1 for base, _ in payloads if base is None),
+        }
+
+        print(f'''info: broadcast: round took {duration:.3f}s, {self.broadcast_stats['succeeded']}/{len(results)} peers succeeded, slowest {self.broadcast_stats['slowest_s']:.3f}s, sent {self.broadcast_stats['bytes_sent']} bytes''')
 
-        for peer_name, peer_info in peers.items():
+    # build (or reuse from this round) the payload for a peer, returning (content type, payload)
+    # peers that are caught up enough get the changes since the seq they last told us they had, everyone else gets a snapshot
+    # peers that have said they take it get the binary encoding, everyone else gets JSON
+    def gossip_payload(self, peer_name, payloads):
 
-            # set up host string to reduce bugs
-            host = f"{peer_info['name']}:{peer_info['port']}"
+        base = None
+        ack = self.gossip_acks.get(peer_name)
+        if ack and ack[0] == self.gossip_epoch and self.pin_seq - len(self.pin_changes) <= ack[1] <= self.pin_seq:
+            base = ack[1]
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
-                
-                print(f'info: broadcast: posting pins to {peer_name} @ {host}')
+        binary = self.gossip_formats.get(peer_name, False)
 
-                if self.DBG: pprint.pprint(self.pins)
+        if (base, binary) not in payloads:
+            if base is None:
+                body = {'node': self.name, 'epoch': self.gossip_epoch, 'seq': self.pin_seq, 'snapshot': list(self.pins)}
+            else:
+                changes = itertools.islice(self.pin_changes, len(self.pin_changes) - (self.pin_seq - base), None)
+                body = {'node': self.name, 'epoch': self.gossip_epoch, 'seq': self.pin_seq, 'base': base, 'changes': list(changes)}
 
+            payloads[(base, binary)] = None
+            if binary:
                 try:
-                    async with session.post(f'''http://{host}/info''', json=payload) as resp:
+                    payloads[(base, binary)] = (gossip_funcs.CONTENT_TYPE, gossip_funcs.encode_gossip(body, self.GOSSIP_COMPRESS_MIN))
+                except ValueError:
+                    print('info: broadcast: some pins cannot be packed, falling back to JSON')
+            if not payloads[(base, binary)]:
+                payloads[(base, binary)] = ('application/json', json.dumps(body).encode())
+
+        return payloads[(base, binary)]
+
+    # post pins to a single peer, returning (success, seconds taken, bytes sent)
+    async def broadcast_to(self, limit, peer_name, peer_info, payloads):
+
+        # set up host string to reduce bugs
+        host = f"{peer_info['name']}:{peer_info['port']}"
+
+        async with limit:
+
+            print(f'info: broadcast: posting pins to {peer_name} @ {host}')
+
+            start = time.perf_counter()
+            success = False
+            sent = 0
+
+            try:
+                # second go is only for when the peer couldn't use our changes and wants a snapshot
+                for _ in range(2):
+                    content_type, payload = self.gossip_payload(peer_name, payloads)
+                    sent += len(payload)
+                    async with self.session.post(f'''http://{host}/info''', data=payload, headers={'Content-Type': content_type}, timeout=aiohttp.ClientTimeout(total=self.PEER_TIMEOUT)) as resp:
+                        self.gossip_formats[peer_name] = gossip_funcs.CONTENT_TYPE in resp.headers.get('Accept-Post', '')
                         if resp.status == 200:
+                            ack = await resp.json()
+                            self.gossip_acks[peer_name] = (ack['epoch'], ack['seq'])
                             print(f'info: broadcast: successfully posted pins to {peer_name} @ {host}')
+                            success = True
+                            break
+                        elif resp.status == 409:
+                            self.gossip_acks.pop(peer_name, None)
+                            print(f'info: broadcast: {peer_name} @ {host} is out of sync, sending snapshot')
                         else:
                             print(f'info: broadcast: failed posting pins to {peer_name} @ {host}: {resp.status} - {resp.reason}')
-                except asyncio.TimeoutError as time_err:
-                    print(f'info: broadcast: time out posting pins to {peer_name} @ {host}: {time_err}')
-                except aiohttp.ClientError as client_err:
-                    print(f'info: broadcast: failed posting pins to {peer_name} @ {host}: {client_err}')
+                            break
+            except asyncio.TimeoutError as time_err:
+                print(f'info: broadcast: time out posting pins to {peer_name} @ {host}: {time_err}')
+            except aiohttp.ClientError as client_err:
+                print(f'info: broadcast: failed posting pins to {peer_name} @ {host}: {client_err}')
+
+            return success, time.perf_counter() - start, sent
 
     # ADD operation
     async def add_handler(self, request):
@@ -504,65 +1044,337 @@ class sPinServer:
         write_success = False
         recv_success = False
 
+        # unique temp name, so concurrent adds of the same content don't write over each other
+        temp_location = f'{self.PIN_DIR}/{hash}.{uuid.uuid4().hex}.{self.TEMP_EXTENSION}'
+
         async for field in (await request.multipart()):
 
             if field.name == 'data':
                 recv_success = True
+                digest = hashlib.sha256()
                 try:
-                    with open(f'{self.PIN_DIR}/{hash}.{self.TEMP_EXTENSION}', 'wb') as file:
+                    with await self.disk.open(temp_location, 'wb') as file:
                         while True:
-                            chunk = await field.read_chunk()
+                            chunk = await field.read_chunk(self.STREAM_CHUNK_SIZE)
                             if not chunk:
                                 break
-                            file.write(chunk)
+                            digest.update(chunk)
+                            await self.disk.write(file, chunk)
 
                         # ensure written out
-                        file.flush()
-                        os.fsync(file.fileno())
-                    os.rename(f'{self.PIN_DIR}/{hash}.{self.TEMP_EXTENSION}', f'{self.PIN_DIR}/{hash}')
+                        await self.disk.sync(file)
+
+                    # wrong content, which must never be pinned since /link trusts whatever is pinned under a hash
+                    if digest.hexdigest() != hash:
+                        print(f'error: add: received data for {identifier} did not match its hash, discarding it')
+                        self.discard(temp_location)
+                        return web.Response(status=400)
+
+                    # renamed here rather than on the disk pool, so it lands at the same moment it's pinned below
+                    os.rename(temp_location, f'{self.PIN_DIR}/{hash}')
                     write_success = True
-                except OSError as os_err:
+                except (OSError, aiohttp.ClientPayloadError):
                     print(f'error: add: failed writing {identifier} to disk')
-                    try:
-                        os.unlink(f'{self.PIN_DIR}/{hash}.{self.TEMP_EXTENSION}')
-                    except OSError:
-                        pass # just didn't even manage to create the first thing
+                    self.discard(temp_location) # if we even managed to create it
             else:
                 continue # skip if not data field
 
-        # add to pins dict
-        self.log_pins('ADD', identifier)
-        self.pins[identifier] = hash
+        if not recv_success: # failed to receive data because of something with the POST
+            return web.Response(status=400)
+        elif not write_success: # failed to write data
+            return web.Response(status=500)
 
-        if write_success and recv_success:
-            return web.Response()
-        elif not recv_success: # failed to receive data because of something with the POST
+        # a manifest is only pinned once every chunk it lists is here
+        if not self.manifest_ready(identifier, hash):
+            return web.Response(status=409)
+
+        # add to pins dict, only answering once that's durable
+        if not await self.pin_logged(identifier, hash):
+            return web.Response(status=500)
+
+        return web.Response()
+
+    # UPLOAD session
+    # for big objects, an upload can be resumed from wherever it got to instead of started over
+    # GET says how much is committed, PUT ?offset= appends from there, POST .../complete checks the hash and pins it
+    async def upload_status_handler(self, request):
+        identifier = request.match_info['identifier']
+
+        return web.json_response({'offset': self.upload_offset(identifier)})
+
+    # append to an upload session, keeping whatever arrives even if the connection drops
+    async def upload_append_handler(self, request):
+        identifier = request.match_info['identifier']
+
+        try:
+            offset = int(request.query['offset'])
+        except (KeyError, ValueError):
             return web.Response(status=400)
-        else: # failed to write data
+
+        if identifier in self.uploads_busy:
+            return web.json_response({'offset': self.upload_offset(identifier)}, status=409)
+
+        committed = self.upload_offset(identifier)
+        if offset != committed:
+            print(f'info: upload: {identifier} sent from {offset}, but we have {committed}')
+            return web.json_response({'offset': committed}, status=409)
+
+        self.uploads_busy.add(identifier)
+        try:
+            with await self.disk.open(self.upload_location(identifier), 'ab') as file:
+                try:
+                    async for data in request.content.iter_chunked(self.STREAM_CHUNK_SIZE):
+                        await self.disk.write(file, data)
+                except (aiohttp.ClientPayloadError, ConnectionError):
+                    print(f'info: upload: {identifier} was interrupted, keeping what arrived')
+                finally:
+                    # ensure written out, so what we report is really there
+                    await self.disk.sync(file)
+                committed = file.tell()
+        except OSError as os_err:
+            print(f'error: upload: failed writing {identifier} to disk: {os_err}')
             return web.Response(status=500)
+        finally:
+            self.uploads_busy.discard(identifier)
+            self.uploads[identifier] = time.time()
+
+        print(f'info: upload: {identifier} has {committed} bytes')
+        return web.json_response({'offset': committed})
+
+    # finish an upload session, pinning it if it matches its hash
+    async def upload_complete_handler(self, request):
+        identifier = request.match_info['identifier']
+
+        hash = identifier.split(':')[1]
+
+        if identifier in self.uploads_busy:
+            return web.Response(status=409)
+        if identifier not in self.uploads:
+            return web.Response(status=404)
+
+        self.uploads_busy.add(identifier)
+        try:
+            try:
+                digest = await self.disk.digest(self.upload_location(identifier))
+            except OSError as os_err:
+                print(f'error: upload: failed reading back {identifier}: {os_err}')
+                return web.Response(status=500)
+
+            # wrong content, the client will have to start over
+            if digest != hash:
+                print(f'error: upload: {identifier} did not match its hash, discarding it')
+                self.drop_upload(identifier)
+                return web.Response(status=400)
+
+            # moved here rather than on the disk pool, so it lands at the same moment it's pinned below
+            try:
+                os.replace(self.upload_location(identifier), f'{self.PIN_DIR}/{hash}')
+            except OSError as os_err:
+                print(f'error: upload: failed moving {identifier} into pins: {os_err}')
+                return web.Response(status=500)
+            self.uploads.pop(identifier, None)
+        finally:
+            self.uploads_busy.discard(identifier)
+
+        # a manifest is only pinned once every chunk it lists is here
+        if not self.manifest_ready(identifier, hash):
+            return web.Response(status=409)
+
+        if not self.pins.get(identifier) and not await self.pin_logged(identifier, hash):
+            return web.Response(status=500)
+
+        print(f'info: upload: pinned {identifier}')
+        return web.Response()
+
+    # LINK operation
+    # pin an object whose content we already hold, so the client doesn't have to send it again
+    async def link_handler(self, request):
+        identifier = request.match_info['identifier']
+
+        hash = identifier.split(':')[1]
+
+        print(f'info: link: received link request for {identifier}')
+
+        # the pins table can't be taken at its word, the file has to be there to link to
+        if not (self.pin_hashes.get(hash) and os.path.isfile(f'{self.PIN_DIR}/{hash}')):
+            if not await self.cache_hit(hash):
+                print(f'info: link: do not have content for {identifier}')
+                return web.Response(status=404)
+
+            # promote the cached copy to a pinned one, as long as it isn't a manifest we lack chunks for
+            try:
+                if self.missing_chunks(f'{self.CACHE_DIR}/{hash}'):
+                    print(f'info: link: do not have every chunk for {identifier}')
+                    return web.Response(status=404)
+                os.link(f'{self.CACHE_DIR}/{hash}', f'{self.PIN_DIR}/{hash}')
+            except FileExistsError:
+                pass
+            except OSError as os_err:
+                print(f'error: link: failed pinning cached {identifier}: {os_err}')
+                return web.Response(status=404)
+
+        if not self.pins.get(identifier) and not await self.pin_logged(identifier, hash):
+            return web.Response(status=500)
+
+        print(f'info: link: pinned {identifier} without an upload')
+        return web.Response()
+
+    # CHUNKS operation
+    # which of a list of chunks we don't have, so the sender only sends those
+    async def chunks_handler(self, request):
+
+        try:
+            hashes = await request.json()
+            missing = [hash for hash in hashes if hash not in self.chunks]
+        except (ValueError, TypeError):
+            return web.Response(status=400)
+
+        # the sender won't send the ones we have, so keep any unused ones around for its manifest
+        now = time.time()
+        for hash in hashes:
+            if hash in self.chunk_orphans:
+                self.chunk_orphans[hash] = now
+
+        return web.json_response({'missing': missing})
+
+    # CHUNK upload
+    # body is the raw chunk, only stored if it matches its hash
+    async def chunk_add_handler(self, request):
+        hash = request.match_info['hash']
+
+        if not chunk_funcs.is_hash(hash):
+            return web.Response(status=400)
+
+        if hash in self.chunks:
+            if hash in self.chunk_orphans:
+                self.chunk_orphans[hash] = time.time()
+            return web.Response()
+
+        # unique temp name, so the same chunk arriving twice at once doesn't get mixed up
+        temp_location = f'{self.CHUNK_DIR}/{hash}.{uuid.uuid4().hex}.{self.TEMP_EXTENSION}'
+        digest = hashlib.sha256()
+
+        try:
+            with await self.disk.open(temp_location, 'wb') as file:
+                async for data in request.content.iter_chunked(self.STREAM_CHUNK_SIZE):
+                    digest.update(data)
+                    await self.disk.write(file, data)
+
+                # ensure written out
+                await self.disk.sync(file)
+
+            if digest.hexdigest() != hash:
+                print(f'error: chunk: received chunk did not match its hash {hash}')
+                self.discard(temp_location)
+                return web.Response(status=400)
+
+            os.rename(temp_location, f'{self.CHUNK_DIR}/{hash}')
+        except (OSError, aiohttp.ClientPayloadError):
+            print(f'error: chunk: failed receiving chunk {hash}')
+            self.discard(temp_location)
+            return web.Response(status=500)
+
+        self.chunks.add(hash)
+        if not self.chunk_refs.get(hash):
+            self.chunk_orphans[hash] = time.time()
+
+        return web.Response()
+
+    # CHUNK get
+    # ?object=UUID:HASH names a manifest listing the chunk, so a client can ask any peer and it can fetch from that object's pins
+    async def chunk_get_handler(self, request):
+        hash = request.match_info['hash']
+        identifier = request.query.get('object')
+
+        # same hack as GET to tell peers from clients
+        if request.body_exists and (await request.text()) == 'peer':
+            peer = True
+        else:
+            peer = False
+        who = 'client' if not peer else 'peer'
+
+        if not chunk_funcs.is_hash(hash):
+            return web.Response(status=404)
+
+        if hash in self.chunks:
+            return web.FileResponse(f'{self.CHUNK_DIR}/{hash}')
+        elif await self.cache_hit(hash):
+            return web.FileResponse(f'{self.CACHE_DIR}/{hash}')
+        elif not peer and identifier and self.world.get(identifier):
+            print(f'info: chunk: retrieving chunk {hash} of {identifier} for {who}')
+            return await self.fetch_missing(request, identifier, hash, who, f'/chunk/{hash}')
+        else:
+            return web.Response(status=404)
 
     # INFO operation
     async def info_handler(self, request):
 
         recv_time = time.time()
-        payload = await request.json()
 
-        print(f'info: info: received pins from peer')
+        # advertise that we take binary gossip
+        headers = {'Accept-Post': f'{gossip_funcs.CONTENT_TYPE}, application/json'}
+
+        if request.content_type == gossip_funcs.CONTENT_TYPE:
+            try:
+                payload = gossip_funcs.decode_gossip(await request.read())
+            except ValueError as decode_err:
+                print(f'error: info: could not decode gossip: {decode_err}')
+                return web.Response(status=400, headers=headers)
+        else:
+            payload = await request.json()
+
+        node = payload['node']
+
+        print(f'info: info: received pins from peer {node}')
 
         if self.DBG:
             print(f'full payload:')
             pprint.pprint(payload)
-        
-        for record in payload:
+
+        known = self.gossip_state.get(node)
+
+        # objects the node has started or stopped pinning, as of this message
+        if 'snapshot' in payload:
+            # start over from the snapshot, going by what the worldview has for the node rather than keeping another copy of it
+            objects = set(payload['snapshot'])
+            held = self.world.nodes.get(node, set())
+            added = objects - held
+            removed = held - objects
+            known = {'epoch': payload['epoch'], 'seq': payload['seq']}
+            self.gossip_state[node] = known
+        elif known and self.world.knows(node) and known['epoch'] == payload['epoch'] and payload['base'] <= known['seq']:
+            # apply only the changes we haven't seen yet, the last one for an object being the one that counts
+            latest = {}
+            for seq, op, obj in payload['changes']:
+                if seq > known['seq']:
+                    latest[obj] = op
+            added = [obj for obj, op in latest.items() if op == 'ADD']
+            removed = [obj for obj, op in latest.items() if op != 'ADD']
+            known['seq'] = max(known['seq'], payload['seq'])
+        else:
+            # missing changes in between (or we never heard from this epoch, or forgot the node since), ask for a snapshot
+            print(f'info: info: cannot apply changes from {node}, requesting snapshot')
+            return web.json_response({'epoch': None, 'seq': None}, status=409, headers=headers)
+
+        for obj in removed:
+            self.world.forget(obj, node)
+
+        to_notify = []
+        for obj in added:
             
-            if record['object'] in self.dels and self.peers.get(record['node']):
-                address = f'''{self.peers[record['node']]['name']}:{self.peers[record['node']]['port']}'''
-                await self.notify_deletion(address, record['object'])
+            if obj in self.dels and self.peers.get(node):
+                to_notify.append(obj)
             else:
                 # add record to world
-                self.world[record['object']].append({'node': record['node'], 'lastheardfrom': recv_time})
+                self.world.heard(obj, node, recv_time)
 
-        return web.Response()
+        # everything else the node pins is still current
+        self.world.alive(node, recv_time)
+
+        for obj in to_notify:
+            self.send_deletion(node, obj)
+
+        return web.json_response({'epoch': known['epoch'], 'seq': known['seq']}, headers=headers)
     
     # DEL operation
     async def del_handler(self, request):
@@ -582,36 +1394,68 @@ class sPinServer:
 
         # add to dels
         if not drop and identifier not in self.dels: 
-            self.log_del(identifier)
-            self.dels.append(identifier)
+            self.dels[identifier] = None
+            if not await self.log_del(identifier):
+                self.dels.pop(identifier, None)
+                return web.Response(status=500)
+
+            # gossip only says what's changed, so nodes we already know pin it won't bring it up again, tell them now
+            for node in self.world.get(identifier) or ():
+                self.send_deletion(node, identifier)
 
         # delete from pins and cache
         # only do it if it actually exists though
         if self.pins.get(identifier):
-            self.log_pins('DEL', identifier)
-            del self.pins[identifier]
+            self.unpin_object(identifier)
+            if not await self.log_pins('DEL', identifier):
+                self.undo_pins('DEL', identifier, hash)
+                return web.Response(status=500)
 
         if not drop:
-            if self.cache.get(hash):
-                del self.cache[hash]
+            self.uncache(hash)
 
         # delete file if no other pins refer to it
+        # checked only now, since the content may have been pinned or cached again while we waited on the logs
         hash = identifier.split(':')[1]
-        if hash not in self.pins.values():
-            try:
-                os.remove(f'{self.PIN_DIR}/{hash}')
-            except FileNotFoundError:
+        if not self.pin_hashes.get(hash):
+            if not self.discard(f'{self.PIN_DIR}/{hash}'):
                 print(f'info: del: {identifier} not found to delete from pins')
         # delete file if was cached but now shouldn't be
-        if not drop and hash not in self.cache.values():
-            try:
-                os.remove(f'{self.CACHE_DIR}/{hash}')
-            except FileNotFoundError:
+        if not drop and hash not in self.cache:
+            if not self.discard(f'{self.CACHE_DIR}/{hash}'):
                 print(f'info: del: {identifier} not found to delete from cache')
+        # and from memory if it's no longer held at all
+        if not self.pin_hashes.get(hash) and hash not in self.cache:
+            self.memory.remove(hash)
 
         return web.Response()
 
 
+    # REFS operation
+    # which objects pinned here share a blob, for dedup reporting
+    async def refs_handler(self, request):
+        hash = request.match_info['hash']
+
+        return web.json_response({
+            'hash': hash,
+            'pins': sorted(self.pin_hashes.get(hash, ())),
+            'cached': hash in self.cache,
+        })
+
+    # STATS operation
+    # how this peer is doing, for watching it under load
+    async def stats_handler(self, request):
+
+        return web.json_response({
+            'loop': self.loop_stats,
+            'broadcast': self.broadcast_stats,
+            'repairs': {'waiting': len(self.repairs), 'completed': self.repairs.completed, 'failed': self.repairs.failed},
+            'wal': {'commits': self.wal.commits, 'records': self.wal.committed, 'checkpoints': self.wal.checkpoints},
+            'tables': self.table_stats,
+            'cache': self.cache.stats(),
+            'memory': self.memory.stats(),
+        })
+
     # GET operation
     async def get_handler(self, request):
         identifier = request.match_info['identifier']
@@ -628,99 +1472,279 @@ class sPinServer:
 
         print(f'info: get: received request for {identifier}')
 
+        # the id carries the hash of the content, so it makes a strong ETag, set on whatever response goes out by tag_response
+        request['etag'] = f'"{hash}"'
+
+        # FileResponse takes care of Range requests, so clients can pull parts of an object from several of us at once
         if self.pins.get(identifier):
             print(f'info: get: {identifier} is pinned, providing to {who}')
-            return web.FileResponse(f'{self.PIN_DIR}/{hash}')
-        elif self.cache.get(hash):
+            return await self.held_response(request, hash, f'{self.PIN_DIR}/{hash}')
+        elif await self.cache_hit(hash):
             print(f'info: get: {identifier} is cached, providing to {who}')
-            return web.FileResponse(f'{self.CACHE_DIR}/{hash}')
+            return await self.held_response(request, hash, f'{self.CACHE_DIR}/{hash}')
+        elif 'Range' in request.headers:
+            # ranged requests come from clients looking for peers that already hold the object, so don't go fetching it
+            print(f'info: get: {identifier} not held here, not retrieving it for a ranged request')
+            return web.Response(status=404)
         elif not peer and self.world.get(identifier): # only go looking if the request is from a client
-            print(f'info: get: {identifier} is known, retrieving for {who}')
-            
-            # shuffle options to try
-            # node = random.choice(self.world[identifier])
-            nodes = random.sample(self.world[identifier], k=len(self.world[identifier]))
+            if self.not_modified(request, hash):
+                print(f'info: get: {identifier} is known and {who} already has it')
+                return web.Response(status=304)
+            return await self.fetch_missing(request, identifier, hash, who, f'/get/{identifier}')
+        else:
+            return web.Response(status=404)
 
-            for node in nodes:
+    # answer with content we hold at location
+    # small objects are answered from memory once they've been read, anything else (and any Range request) gets a FileResponse
+    async def held_response(self, request, hash, location):
 
-                # get host for node
-                node_name = node['node']
-                host = f"{self.peers[node_name]['name']}:{self.peers[node_name]['port']}"
+        if self.not_modified(request, hash):
+            return web.Response(status=304)
 
+        if 'Range' in request.headers:
+            return web.FileResponse(location)
+
+        held = self.memory.get(hash)
+        if held is None:
+            try:
+                stat = await self.disk.stat(location)
+                if stat.st_size > self.MEMORY_OBJECT_MAX:
+                    return web.FileResponse(location)
+                body = await self.disk.run(storage.read_file, location)
+            except OSError:
+                return web.FileResponse(location) # let it deal with whatever went wrong
+
+            held = (body, {'Content-Type': 'application/octet-stream', 'Accept-Ranges': 'bytes', 'ETag': f'"{hash}"'})
+            # unless it stopped being held while it was read
+            if self.pin_hashes.get(hash) or hash in self.cache:
+                self.memory.put(hash, *held)
+
+        body, headers = held
+        return web.Response(body=body, headers=headers)
+
+    # whether the client says it already has the content with this hash
+    def not_modified(self, request, hash):
+        return any(etag.value in (hash, '*') for etag in request.if_none_match or ())
+
+    # put the ETag for the object a GET was for on its response, just before the headers go out
+    # FileResponse sets an ETag of its own from the file's mtime and size, which would change if the file were recached
+    async def tag_response(self, request, response):
+        etag = request.get('etag')
+        if etag and response.status in (200, 206, 304):
+            response.headers['ETag'] = etag
+
+    # fetch content we don't have from the pins of identifier, at path on each of them
+    # whoever asks first does the fetch, anyone asking for the same content meanwhile waits for it to land in the cache
+    async def fetch_missing(self, request, identifier, hash, who, path):
+
+        # if someone else is already fetching this content, wait for them to fill the cache rather than fetching it again
+        while self.inflight.get(hash):
+            print(f'info: get: {identifier} is already being retrieved, waiting on it for {who}')
+            flight = self.inflight[hash]
+            flight['waiting'] += 1
+            try:
+                await asyncio.shield(flight['done'])
+                # the request was already counted as a miss, so this isn't looked up again
+                if hash in self.cache:
+                    print(f'info: get: {identifier} is now cached, providing to {who}')
+                    return web.FileResponse(f'{self.CACHE_DIR}/{hash}')
+                # it wasn't let into the cache, but was kept for us, so send it all before letting go of it
+                if flight['kept']:
+                    print(f'info: get: {identifier} was retrieved but not cached, providing to {who}')
+                    response = web.FileResponse(flight['kept'])
+                    await response.prepare(request)
+                    return response
+            finally:
+                flight['waiting'] -= 1
+                if flight['kept'] and not flight['waiting']:
+                    self.discard(flight['kept'])
+            # that fetch failed, go again (or wait on whoever went again first)
+
+        print(f'info: get: {identifier} is known, retrieving for {who}')
+
+        # records look like: {'done': future set once the fetch is over, 'waiting': requests waiting on it, 'kept': path of content the cache turned away}
+        flight = {'done': asyncio.get_running_loop().create_future(), 'waiting': 0, 'kept': None}
+        self.inflight[hash] = flight
+        try:
+            return await self.fetch_from_peers(request, identifier, hash, who, path, flight)
+        finally:
+            del self.inflight[hash]
+            flight['done'].set_result(None)
+            # whoever asked meanwhile has already counted themselves in, so if nobody did, nobody needs it
+            if flight['kept'] and not flight['waiting']:
+                self.discard(flight['kept'])
+
+    # try peers known to pin an object until one can stream it to the client
+    async def fetch_from_peers(self, request, identifier, hash, who, path, flight):
+
+        # shuffle options to try
+        # node = random.choice(self.world[identifier])
+        nodes = random.sample(list(self.world.get(identifier) or ()), k=len(self.world.get(identifier) or ()))
+
+        for node_name in nodes:
+
+            # get host for node, skipping it if it's gone away since we heard from it
+            if not self.peers.get(node_name):
+                continue
+            host = f"{self.peers[node_name]['name']}:{self.peers[node_name]['port']}"
+
+            try:
+                response = await self.stream_from_peer(request, identifier, hash, host, path, flight)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                response = None
+
+            if response is None:
+                print(f'info: get: failed retrieving {identifier} from {node_name} @ {host}')
+                continue
+
+            print(f'info: get: streamed {identifier} from {node_name} @ {host} to {who}')
+            return response
+
+        return web.Response(status=404)
+    
+    # stream an object from a peer straight through to the client, teeing it into the cache as it goes
+    # the cache entry is only published if the whole thing arrives and matches its hash
+    # if the cache turns it away while other requests are waiting on this fetch, it's kept for them in flight
+    # returns None if the peer couldn't provide it before we started responding, the response otherwise
+    async def stream_from_peer(self, request, identifier, hash, host, path, flight):
+
+        # unique temp name, so concurrent misses for the same hash don't write over each other
+        temp_location = f'{self.CACHE_DIR}/{hash}.{uuid.uuid4().hex}.{self.TEMP_EXTENSION}'
+
+        async with self.session.get(f'http://{host}{path}', data='peer') as upstream:
+            if upstream.status != 200:
+                return None
+
+            response = web.StreamResponse()
+            response.content_type = 'application/octet-stream'
+            if upstream.content_length is not None:
+                response.content_length = upstream.content_length
+            await response.prepare(request)
+
+            try:
+                file = await self.disk.open(temp_location, 'wb')
+            except OSError:
+                print(f'error: get: could not open cache file for {identifier}, not caching')
+                file = None
+
+            digest = hashlib.sha256()
+            size = 0
+            client_gone = False
+            complete = False
+
+            try:
+                async for chunk in upstream.content.iter_chunked(self.STREAM_CHUNK_SIZE):
+                    digest.update(chunk)
+                    size += len(chunk)
+
+                    # send to client and write to cache at the same time
+                    writes = []
+                    if file:
+                        writes.append(self.disk.write(file, chunk))
+                    if not client_gone:
+                        writes.append(response.write(chunk))
+                    results = await asyncio.gather(*writes, return_exceptions=True)
+
+                    for result in results:
+                        if isinstance(result, ConnectionError):
+                            # client left, but keep filling the cache
+                            client_gone = True
+                        elif isinstance(result, OSError):
+                            print(f'error: get: failed caching {identifier} to disk')
+                            file.close()
+                            self.discard(temp_location)
+                            file = None
+                        elif isinstance(result, BaseException):
+                            raise result
+
+                    if client_gone and not file:
+                        break
+                else:
+                    complete = True
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                print(f'error: get: lost connection to {host} while streaming {identifier}')
+
+            # publish to cache only if everything arrived and checks out
+            if file:
                 try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(f'http://{host}/get/{identifier}', data='peer') as response:
-                            data = await response.read()
-
-                            # write to cache
-                            try:
-                                with open(f'{self.CACHE_DIR}/{hash}.{self.TEMP_EXTENSION}', 'wb') as file:
-                                    file.write(data)
-                                    file.flush()
-                                    os.fsync(file.fileno())
-
-                                # achieve atomic write
-                                os.rename(f'{self.CACHE_DIR}/{hash}.{self.TEMP_EXTENSION}', f'{self.CACHE_DIR}/{hash}')
-
-                                # add to cache
-                                self.cache[hash] = hash
-
-                                print(f'info: get: retrieved and cached {identifier} from {node_name} @ {host}, providing to {who}')
-                                return web.FileResponse(f'{self.CACHE_DIR}/{hash}')
-                            
-                            except OSError as os_err:
-                                print(f'error: add: failed caching {identifier} to disk')
-                                try:
-                                    os.unlink(f'{self.CACHE_DIR}/{hash}.{self.TEMP_EXTENSION}')
-                                except OSError:
-                                    pass # just didn't even manage to create the first thing
-
-                except aiohttp.ClientError:
-                    print(f'info: get: failed retrieving {identifier} from {node_name} @ {host}')
-                    continue
-
-            web.Response(status=404)
+                    if complete:
+                        await self.disk.sync(file)
+                    file.close()
+
+                    if complete and digest.hexdigest() == hash:
+                        if self.add_cached(hash, size):
+                            os.rename(temp_location, f'{self.CACHE_DIR}/{hash}')
+                        elif flight['waiting']:
+                            print(f'info: get: not caching {identifier}, keeping it for {flight["waiting"]} requests waiting on it')
+                            flight['kept'] = temp_location
+                        else:
+                            print(f'info: get: not caching {identifier}, not asked for as often as what it would push out')
+                            self.discard(temp_location)
+                    else:
+                        if complete:
+                            print(f'error: get: {identifier} from {host} did not match its hash, not caching')
+                        self.discard(temp_location)
+                except OSError:
+                    print(f'error: get: failed caching {identifier} to disk')
+
+            # if we couldn't send the whole thing, make sure the client sees a short response rather than a complete one
+            if not complete:
+                response.force_close()
+            elif not client_gone:
+                await response.write_eof()
+
+            return response
+
+    # start telling node about a deletion record in the background, unless that's already under way
+    def send_deletion(self, node, object):
+        if self.peers.get(node) and self.del_notices.get((node, object)) is None:
+            self.del_notices[(node, object)] = asyncio.ensure_future(self.deliver_deletion(node, object))
+
+    # tell node about a deletion record, keeping it for maintain to send again if it doesn't get through
+    async def deliver_deletion(self, node, object):
+        peer = self.peers.get(node)
+        if peer is None or await self.notify_deletion(f'''{peer['name']}:{peer['port']}''', object):
+            self.del_notices.pop((node, object), None)
         else:
-            return web.Response(status=404)
-    
+            self.del_notices[(node, object)] = None
+
     # deletion notifier
-    # where node is the name of the node and object is the UUID:HASH combo
+    # where node is the name of the node and object is the UUID:HASH combo, returning whether node took it
     async def notify_deletion(self, node, object):
 
         print(f'info: notify_deletion: notifying {node} that a deletion record for {object} exists')
 
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+        try:
+            async with self.session.post(f'http://{node}/del/{object}', timeout=aiohttp.ClientTimeout(total=self.PEER_TIMEOUT)) as resp:
+                # error check
+                if resp.status == 200:
+                    print(f'info: notify_deletion: successfully notified {node} to delete {object}')
+                    return True
+                else:
+                    print(f'info: notify_deletion: failed to notify {node} to delete {object}')
+        except asyncio.TimeoutError as time_err:
+                print(f'info: notify_deletion: time out notifying {node}')
+        except aiohttp.ClientError as req_err:
+            print(f'error: notify_deletion: could not notify: {req_err}')
 
-            try:
-                async with session.post(f'http://{node}/del/{object}') as resp:
-                    # error check
-                    if resp.status == 200:
-                        print(f'info: notify_deletion: successfully notified {node} to delete {object}')
-                    else:
-                        print(f'info: notify_deletion: failed to notify {node} to delete {object}')
-            except asyncio.TimeoutError as time_err:
-                    print(f'info: notify_deletion: time out notifying {node}')
-            except aiohttp.ClientError as req_err:
-                print(f'error: notify_deletion: could not notify: {req_err}')
+        return False
 
     # drop notifier
     async def notify_drop(self, node, object):
 
         print(f'info: notify_drop: notifying {node} that it should drop {object}')
 
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
-
-            try:
-                async with session.post(f'http://{node}/del/{object}', data='drop') as resp: # include marker that this is a drop, not a full delete
-                    # error check
-                    if resp.status == 200:
-                        print(f'info: notify_drop: successfully notified {node} to drop {object}')
-                    else:
-                        print(f'info: notify_drop: failed to notify {node} to drop {object}')
-            except asyncio.TimeoutError as time_err:
-                    print(f'info: notify_drop: time out notifying {node}')
-            except aiohttp.ClientError as req_err:
-                print(f'error: notify_drop: could not notify: {req_err}')
+        try:
+            async with self.session.post(f'http://{node}/del/{object}', data='drop', timeout=aiohttp.ClientTimeout(total=self.PEER_TIMEOUT)) as resp: # include marker that this is a drop, not a full delete
+                # error check
+                if resp.status == 200:
+                    print(f'info: notify_drop: successfully notified {node} to drop {object}')
+                else:
+                    print(f'info: notify_drop: failed to notify {node} to drop {object}')
+        except asyncio.TimeoutError as time_err:
+                print(f'info: notify_drop: time out notifying {node}')
+        except aiohttp.ClientError as req_err:
+            print(f'error: notify_drop: could not notify: {req_err}')
 
 
     # add notifier/uploader
@@ -730,33 +1754,111 @@ class sPinServer:
 
         hash = object.split(':')[1]
 
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+        # a manifest won't be taken until every chunk it lists is there
+        if hash in self.manifests and not await self.push_chunks(node, self.manifests[hash]):
+            return
 
-            try:
-                with open(f'{self.PIN_DIR}/{hash}', 'rb') as file:
-                    multipart = {'data': file}
-                    async with session.post(f'''http://{node}/add/{object}''', data=multipart) as resp:
-                        if resp.status == 200:
-                            print(f'info: notify_pin: successfully notified {node} that it should pin {object}')
-                        else:
-                            print(f'info: notify_pin: failed to notify {node} to pin {object}')
-            except FileNotFoundError as file_err:
-                print(f'error: notify_pin: could not open file {self.PIN_DIR}/{hash}: {file_err}')
-            except asyncio.TimeoutError as time_err:
-                    print(f'info: notify_pin: time out notifying {node}')
-            except aiohttp.ClientError as req_err:
-                print(f'error: notify_pin: could not notify: {req_err}')
+        # if it already holds the content, it just needs to record the pin
+        if await self.notify_link(node, object):
+            return
+
+        try:
+            with open(f'{self.PIN_DIR}/{hash}', 'rb') as file:
+
+                # wait for our share of outbound bandwidth
+                size = os.fstat(file.fileno()).st_size
+                await self.repair_budget.take(size)
+
+                multipart = {'data': file}
+                async with self.session.post(f'''http://{node}/add/{object}''', data=multipart, timeout=self.upload_timeout(size)) as resp:
+                    if resp.status == 200:
+                        print(f'info: notify_pin: successfully notified {node} that it should pin {object}')
+                    else:
+                        print(f'info: notify_pin: failed to notify {node} to pin {object}')
+        except FileNotFoundError as file_err:
+            print(f'error: notify_pin: could not open file {self.PIN_DIR}/{hash}: {file_err}')
+        except asyncio.TimeoutError as time_err:
+                print(f'info: notify_pin: time out notifying {node}')
+        except aiohttp.ClientError as req_err:
+            print(f'error: notify_pin: could not notify: {req_err}')
+
+    # how long pushing size bytes to a peer gets
+    # a fixed total would never let a big enough object through, so it grows with the size, while a peer that
+    # can't be reached or stops answering is still given up on quickly
+    def upload_timeout(self, size):
+        return aiohttp.ClientTimeout(total=self.PEER_UPLOAD_TIMEOUT + size / self.PEER_UPLOAD_RATE, sock_connect=self.PEER_TIMEOUT, sock_read=self.PEER_UPLOAD_TIMEOUT)
+
+    # chunk pusher
+    # sends node whichever of chunks it doesn't have yet, returning whether it has them all now
+    async def push_chunks(self, node, chunks):
+
+        try:
+            async with self.session.post(f'http://{node}/chunks', json=list(chunks), timeout=aiohttp.ClientTimeout(total=self.PEER_TIMEOUT)) as resp:
+                resp.raise_for_status()
+                missing = (await resp.json())['missing']
+
+            print(f'info: push_chunks: {node} needs {len(missing)} of {len(chunks)} chunks')
+
+            for hash in missing:
+                with open(f'{self.CHUNK_DIR}/{hash}', 'rb') as file:
+
+                    # wait for our share of outbound bandwidth
+                    size = os.fstat(file.fileno()).st_size
+                    await self.repair_budget.take(size)
+
+                    async with self.session.post(f'http://{node}/chunk/{hash}', data=file, timeout=self.upload_timeout(size)) as resp:
+                        resp.raise_for_status()
+        except asyncio.TimeoutError:
+            print(f'info: push_chunks: time out sending chunks to {node}')
+            return False
+        except (aiohttp.ClientError, ValueError, KeyError) as req_err:
+            print(f'error: push_chunks: could not send chunks to {node}: {req_err}')
+            return False
+        except OSError as file_err:
+            print(f'error: push_chunks: could not open chunk: {file_err}')
+            return False
+
+        return True
+
+    # link notifier
+    # asks node to pin object against content it already has, returning whether it could
+    async def notify_link(self, node, object):
+
+        try:
+            async with self.session.post(f'http://{node}/link/{object}', timeout=aiohttp.ClientTimeout(total=self.PEER_TIMEOUT)) as resp:
+                if resp.status == 200:
+                    print(f'info: notify_link: {node} already had the content for {object}, pinned without uploading')
+                    return True
+        except asyncio.TimeoutError:
+            print(f'info: notify_link: time out notifying {node}')
+        except aiohttp.ClientError as req_err:
+            print(f'error: notify_link: could not notify: {req_err}')
+
+        return False
 
     # server main loop
     async def serve(self):
 
+        self.wal.start()
+
         # set up app
-        app = web.Application()
+        # aiohttp's default of 1MB would turn away a snapshot of more than about 20k pins, or a /chunks list for a file over about 15GB
+        app = web.Application(client_max_size=self.MAX_BODY_SIZE)
         
         app.add_routes([web.post('/info', self.info_handler),
                 web.post('/add/{identifier}', self.add_handler),
+                web.post('/link/{identifier}', self.link_handler),
+                web.get('/upload/{identifier}', self.upload_status_handler),
+                web.put('/upload/{identifier}', self.upload_append_handler),
+                web.post('/upload/{identifier}/complete', self.upload_complete_handler),
                 web.post('/del/{identifier}', self.del_handler),
-                web.get('/get/{identifier}', self.get_handler)])
+                web.post('/chunks', self.chunks_handler),
+                web.post('/chunk/{hash}', self.chunk_add_handler),
+                web.get('/chunk/{hash}', self.chunk_get_handler),
+                web.get('/get/{identifier}', self.get_handler),
+                web.get('/refs/{hash}', self.refs_handler),
+                web.get('/stats', self.stats_handler)])
+        app.on_response_prepare.append(self.tag_response)
 
         # set up aiohttp server
         runner = web.AppRunner(app)
@@ -769,11 +1871,30 @@ class sPinServer:
         self.host = socket.getfqdn()
         print(f'{self.name} @ {self.host}:{self.port}')
 
-        # run other tasks
-        await asyncio.gather(self.update_nameserver(), self.retrieve_peers(), self.maintain())
+        # one pooled session for all outbound traffic, keeping connections alive between rounds
+        connector = aiohttp.TCPConnector(
+            limit=self.PEER_CONN_LIMIT,
+            limit_per_host=self.PEER_CONN_LIMIT_PER_HOST,
+            keepalive_timeout=self.PEER_KEEPALIVE,
+            ttl_dns_cache=self.NAMESERVER_STALENESS,
+        )
+        self.session = aiohttp.ClientSession(connector=connector)
 
-        # wait forever
-        await asyncio.Event().wait()
+        self.repairs.start()
+
+        try:
+            # run other tasks
+            await asyncio.gather(self.update_nameserver(), self.retrieve_peers(), self.maintain(), self.monitor_loop())
+
+            # wait forever
+            await asyncio.Event().wait()
+        finally:
+            self.repairs.stop()
+            self.wal.stop()
+            await self.save_cache_index()
+            await self.session.close()
+            await runner.cleanup()
+            self.disk.shutdown()
 
 if __name__ == '__main__':
     s = sPinServer()
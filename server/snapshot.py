@@ -0,0 +1,77 @@
+#!/bin/usr/env python3
+
+# John Sullivan (jsulli28), Jozef Porubcin (jporubci)
+# snapshot.py
+
+import os
+import itertools
+
+# Snapshot of the pins and deletion tables.
+#
+# A snapshot holds the ids in each table as of one moment, along with the write-ahead log segment begun at that
+# moment, so loading it and replaying that segment and those after it gives back the tables as they were. It also
+# lists which pinned hashes were manifests, so startup doesn't have to open every pinned file to find out.
+#
+# The pins table maps UUID:HASH to the HASH already in it, so only the ids are kept, one per line:
+#
+#   spin-snapshot 1 <segment>
+#   pins <count>
+#   <UUID:HASH>
+#   ...
+#   dels <count>
+#   <UUID:HASH>
+#   ...
+#   manifests <count>
+#   <HASH>
+#   ...
+#   end
+#
+# That's 102 bytes a pin against about 170 as JSON, and loading reads it a line at a time, done in C, rather than
+# parsing every record or holding the whole file in memory alongside the tables. The counts and the trailer catch a
+# file that's been cut short.
+
+MAGIC = 'spin-snapshot'
+VERSION = 1
+TABLES = ['pins', 'dels', 'manifests']
+SLICE = 65536 # ids joined per write, so a thread writing a big snapshot gives the loop the GIL back between them
+
+# write a snapshot to location by way of temp_location, for the disk pool
+# pins, dels and manifests are lists, which nothing else may change while this runs
+def write(location, temp_location, segment, pins, dels, manifests):
+    with open(temp_location, 'w') as file:
+        file.write(f'{MAGIC} {VERSION} {segment}\n')
+        for name, ids in zip(TABLES, [pins, dels, manifests]):
+            file.write(f'{name} {len(ids)}\n')
+            for start in range(0, len(ids), SLICE):
+                file.write('\n'.join(ids[start:start + SLICE]))
+                file.write('\n')
+        file.write('end\n')
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temp_location, location)
+
+# read a snapshot, returning (segment, pin ids, deletion ids, manifest hashes), or None if there isn't one
+# raises ValueError if it's there but broken, since starting without it would lose pins
+def read(location):
+    try:
+        file = open(location, 'r')
+    except FileNotFoundError:
+        return None
+
+    with file:
+        header = file.readline().rstrip('\n').split(' ')
+        if len(header) != 3 or header[0] != MAGIC or header[1] != str(VERSION) or not header[2].isdigit():
+            raise ValueError(f'{location} is not a version {VERSION} snapshot')
+
+        tables = []
+        for name in TABLES:
+            label, _, count = file.readline().rstrip('\n').partition(' ')
+            if label != name or not count.isdigit():
+                raise ValueError(f'{location} is missing its {name}')
+            tables.append([line.rstrip('\n') for line in itertools.islice(file, int(count))])
+
+        if file.readline() != 'end\n':
+            raise ValueError(f'{location} is cut short')
+
+    return int(header[2]), tables[0], tables[1], tables[2]
@@ -0,0 +1,94 @@
+#!/bin/usr/env python3
+
+# John Sullivan (jsulli28), Jozef Porubcin (jporubci)
+# storage.py
+
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+
+# Disk I/O off the event loop.
+#
+# Every call here runs on a small thread pool of its own, so a slow write or fsync only holds up the request waiting
+# on it rather than every request, gossip post and heartbeat on the peer. The pool is bounded, so a burst of uploads
+# queues up for the disk instead of piling up threads, and it's separate from the loop's default executor, so disk
+# work never waits behind (or holds up) anything else that uses that.
+class Storage:
+
+    def __init__(self, workers):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='disk')
+
+    # run func(*args) on the disk pool
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    # run func(*args) on the disk pool without waiting for it
+    def run_soon(self, func, *args):
+        self.executor.submit(func, *args)
+
+    async def open(self, path, mode):
+        return await self.run(open, path, mode)
+
+    async def write(self, file, data):
+        return await self.run(file.write, data)
+
+    # flush and fsync, so what's been written is on disk
+    async def sync(self, file):
+        return await self.run(sync_file, file)
+
+    async def close(self, file):
+        return await self.run(file.close)
+
+    async def replace(self, src, dst):
+        return await self.run(os.replace, src, dst)
+
+    # remove a file, returning whether it was there
+    async def remove(self, path):
+        return await self.run(remove_file, path)
+
+    async def stat(self, path):
+        return await self.run(os.stat, path)
+
+    async def link(self, src, dst):
+        return await self.run(os.link, src, dst)
+
+    # sha256 hexdigest of a file
+    async def digest(self, path):
+        return await self.run(file_digest, path)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+def sync_file(file):
+    file.flush()
+    os.fsync(file.fileno())
+
+def read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+# write data to location by way of temp_location, so location is only ever whole
+def replace_file(location, temp_location, data):
+    with open(temp_location, 'w') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_location, location)
+
+def remove_file(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def file_digest(path, block_size=256 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while True:
+            data = file.read(block_size)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import hashlib
+import cache
+
+def key(name):
+    return hashlib.sha256(name.encode()).hexdigest()
+
+# Room for 10 objects of 100 bytes
+objects = cache.ObjectCache(1000, 1024)
+
+# Fill it with hot objects, each asked for a few times
+hot = [key(f'hot{i}') for i in range(10)]
+for obj in hot:
+    for _ in range(3):
+        objects.lookup(obj)
+    admitted, evicted = objects.admit(obj, 100)
+    assert admitted and not evicted
+
+print(f'Cache holds {len(objects)} hot objects, {objects.size} bytes')
+assert objects.size == 1000
+
+# A scan through cold objects asked for once each shouldn't push any of them out
+for i in range(100):
+    obj = key(f'cold{i}')
+    assert not objects.lookup(obj)
+    admitted, evicted = objects.admit(obj, 100)
+    assert not admitted and not evicted
+
+print(f'After a cold scan: {objects.stats()}')
+assert all(obj in objects for obj in hot)
+
+# Something asked for more often than the least recently used hot object gets in, pushing it out
+objects.lookup(hot[0]) # hot[1] is least recently used now
+warm = key('warm')
+for _ in range(5):
+    objects.lookup(warm)
+admitted, evicted = objects.admit(warm, 100)
+print(f'Admitted warm object, evicting {len(evicted)}')
+assert admitted and evicted == [hot[1]]
+assert objects.size == 1000
+
+# A big object makes room by evicting several, and something bigger than the whole cache never gets in
+big = key('big')
+for _ in range(10):
+    objects.lookup(big)
+admitted, evicted = objects.admit(big, 300)
+assert admitted and len(evicted) == 3 and objects.size <= 1000
+assert objects.admit(key('huge'), 2000) == (False, [])
+
+# Popularity fades: after enough other lookups the sketch is halved
+before = objects.frequency(big)
+for i in range(objects.sample):
+    objects.record(key(f'noise{i}'))
+print(f'Big object frequency went from {before} to {objects.frequency(big)}')
+assert objects.frequency(big) < before
+
+# Rebuilding after a restart keeps order, and trims to capacity from the least recently used end
+rebuilt = cache.ObjectCache(350, 1024)
+for i, (obj, (size, used)) in enumerate(objects.items()):
+    rebuilt.load(obj, size, used)
+trimmed = rebuilt.trim()
+assert rebuilt.size <= 350 and list(rebuilt.items())[-1][0] == list(objects.items())[-1][0]
+print(f'Trimmed {len(trimmed)} entries when rebuilding into a smaller cache')
+
+# Rebuilt with how often each was asked for, a cold scan right after a restart still can't flush them
+restored = cache.ObjectCache(1000, 1024)
+for obj, (size, used) in objects.items():
+    restored.load(obj, size, used, 3)
+    assert restored.frequency(obj) >= 3
+for i in range(100):
+    obj = key(f'restart{i}')
+    restored.lookup(obj)
+    assert restored.admit(obj, 100) == (False, [])
+assert list(restored.items()) == list(objects.items())
+print(f'After a cold scan following a restart: {restored.stats()}')
+
+# Small objects are kept in memory once read, bigger ones never are
+memory = cache.MemoryTier(1000, 200, 1024)
+small = key('small')
+assert memory.get(small) is None
+assert memory.put(small, b'x' * 100, {})
+assert memory.get(small) == (b'x' * 100, {})
+assert not memory.put(key('large'), b'x' * 300, {}) and key('large') not in memory
+memory.remove(small)
+assert small not in memory and memory.index.size == 0
+print(f'Memory tier: {memory.stats()}')
+
+print('RESULTS')
+print('cache admits and evicts as expected')
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import random
+import hashlib
+import tempfile
+import chunk_funcs
+
+directory = tempfile.mkdtemp()
+
+def write(name, data):
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as file:
+        file.write(data)
+    return path
+
+# Create a manifest listing 5 chunks, one of them twice
+chunks = [hashlib.sha256(random.randbytes(16)).hexdigest() for _ in range(5)]
+listed = chunks + [chunks[0]]
+manifest = {'size': 6 * 1024, 'hash': hashlib.sha256(b'').hexdigest(), 'chunks': [[chunk, 1024] for chunk in listed]}
+path = write('manifest', chunk_funcs.MANIFEST_MAGIC + json.dumps(manifest).encode())
+
+print(f'Manifest lists {len(listed)} chunks, {len(chunks)} distinct')
+assert chunk_funcs.read_manifest(path) == tuple(chunks)
+
+# Anything else is a plain object
+for name, data in [('plain', random.randbytes(1024)),
+                   ('empty', b''),
+                   ('broken', chunk_funcs.MANIFEST_MAGIC + b'{not json'),
+                   ('unsafe', chunk_funcs.MANIFEST_MAGIC + json.dumps({'chunks': [['../../meta/name', 10]]}).encode())]:
+    assert chunk_funcs.read_manifest(write(name, data)) is None
+    print(f'Treated {name} object as plain')
+
+print('RESULTS')
+print('manifests read back as expected')
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import gc
+import uuid
+import tempfile
+import snapshot
+
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+directory = tempfile.mkdtemp()
+location = os.path.join(directory, 'tables.snap')
+temp_location = f'{location}.new'
+
+assert snapshot.read(location) is None
+
+# Create n pins and a few deletions
+pins = [f'{uuid.uuid4()}:{os.urandom(32).hex()}' for _ in range(n)]
+dels = pins[:n // 100]
+manifests = [object_id.split(':')[1] for object_id in pins[:10]]
+
+start = time.monotonic()
+snapshot.write(location, temp_location, 7, pins, dels, manifests)
+print(f'Wrote {n} pins in {time.monotonic() - start:.2f}s, {os.path.getsize(location) // n} bytes each')
+assert not os.path.exists(temp_location)
+
+# Read it back and build the pins table the way the server does, with the garbage collector off
+gc.disable()
+start = time.monotonic()
+segment, pin_ids, del_ids, manifest_hashes = snapshot.read(location)
+table = {object_id: object_id.split(':')[1] for object_id in pin_ids}
+print(f'Loaded {len(table)} pins in {time.monotonic() - start:.2f}s')
+gc.enable()
+
+assert segment == 7
+assert pin_ids == pins and del_ids == dels and manifest_hashes == manifests
+assert all(table[object_id] == object_id[37:] for object_id in pins[:1000])
+
+# Empty tables are fine too
+snapshot.write(location, temp_location, 0, [], [], [])
+assert snapshot.read(location) == (0, [], [], [])
+
+# A snapshot cut short is refused rather than loaded as fewer pins
+snapshot.write(location, temp_location, 3, pins[:1000], [], [])
+with open(location, 'r+') as file:
+    file.truncate(os.path.getsize(location) // 2)
+try:
+    snapshot.read(location)
+    assert False
+except ValueError as err:
+    print(f'Refused: {err}')
+
+print('RESULTS')
+print('snapshots read back as expected')
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import os
+import uuid
+import asyncio
+import tempfile
+import storage
+import snapshot
+import wal
+
+directory = tempfile.mkdtemp()
+base = os.path.join(directory, 'wal')
+location = os.path.join(directory, 'tables.snap')
+temp_location = f'{location}.new'
+
+disk = storage.Storage(2)
+
+# pins table, changed before each record is logged the way the server does it
+pins = set()
+
+# save the table as of the start of segment, copied before anything else can change it
+async def checkpoint(segment):
+    await disk.run(snapshot.write, location, temp_location, segment, sorted(pins), [], [])
+
+def make_log():
+    return wal.WriteAheadLog(base, disk, max_batch=64, max_delay=0.002, checkpoint_records=300, checkpoint=checkpoint)
+
+def apply(table, record):
+    op, object_id = record.split(' ')
+    if op == 'ADD':
+        table.add(object_id)
+    else:
+        table.discard(object_id)
+
+async def log(to, op, object_id):
+    apply(pins, f'{op} {object_id}')
+    await to.append(f'{op} {object_id}')
+
+async def write_records():
+    log_ = make_log()
+    assert list(log_.replay()) == []
+    log_.start()
+
+    # Many records at once share fsyncs
+    ids = [f'{uuid.uuid4()}:{os.urandom(32).hex()}' for _ in range(1000)]
+    await asyncio.gather(*[log(log_, 'ADD', object_id) for object_id in ids])
+    await asyncio.gather(*[log(log_, 'DEL', object_id) for object_id in ids[:200]])
+    print(f'{log_.committed} records in {log_.commits} commits')
+    assert log_.committed == 1200 and log_.commits < log_.committed
+
+    # Past checkpoint_records the log moves on to new segments and checkpoints, removing the segments before them
+    while log_.checkpointing is not None:
+        await asyncio.sleep(0.01)
+    print(f'{log_.checkpoints} checkpoints, segments left {log_.segments()}')
+    assert log_.checkpoints >= 1 and log_.segments()[0] > 0
+
+    # A few more after the last checkpoint, one at a time so the last one is alone at the end of the segment
+    for object_id in ids[200:210]:
+        await log(log_, 'DEL', object_id)
+    last = ids[209]
+
+    log_.stop()
+    log_.file.close()
+    return last
+
+last = asyncio.run(write_records())
+expected = set(pins)
+
+# Cut the last segment short in the middle of its last record, as a crash mid-write would
+segments = make_log().segments()
+end = make_log().location(segments[-1])
+with open(end, 'r+') as file:
+    file.truncate(os.path.getsize(end) - 20)
+
+# Recover: load the snapshot, then replay the segments it doesn't cover
+segment, snapshot_pins, _, _ = snapshot.read(location)
+recovered = set(snapshot_pins)
+log_ = make_log()
+for record in log_.replay(segment):
+    apply(recovered, record)
+log_.file.close()
+
+print(f'Recovered {len(recovered)} pins from a snapshot at segment {segment} and segments {segments}')
+assert recovered == expected | {last} # the torn deletion was never acknowledged, so it's as if it never happened
+assert log_.segment > segments[-1] and all(old >= segment for old in log_.segments())
+
+disk.shutdown()
+
+print('RESULTS')
+print('write-ahead log recovered as expected')
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import uuid
+import worldview
+import planner
+
+k = 2
+
+# Create 4 peer names and 3 objects we pin
+peers = [str(uuid.uuid4()) for _ in range(4)]
+objects = [str(uuid.uuid4()) for _ in range(3)]
+
+# We sort before every uuid, so we're the pin that adds pins for an object, but never the one that drops them
+me = ''
+def replicas(obj):
+    others = world.get(obj) or {}
+    return len(others), me <= min(others, default=me), me >= max(others, default=me)
+
+plan = planner.ReplicationPlanner()
+world = worldview.WorldView(on_change=lambda obj: plan.update(obj, obj in objects, *replicas(obj)))
+
+# Nothing known yet, so every object has 0 other pins once k is set
+plan.set_k(k, ((obj, *replicas(obj)) for obj in objects))
+print(f'Pending with no gossip: {plan.pending()}')
+assert [count for _, count in plan.pending()] == [0, 0, 0]
+
+# objects[0] gets k other pins, objects[1] gets k + 1, objects[2] gets 1
+# hearing the same thing again must not count twice
+for when in [1, 2]:
+    for peer in peers[:k]:
+        world.heard(objects[0], peer, when)
+    for peer in peers[:k + 1]:
+        world.heard(objects[1], peer, when)
+    world.heard(objects[2], peers[0], when)
+
+print(f'Worldview holds {len(world)} records')
+assert len(world) == 2 * k + 2
+
+# objects[1] has too many pins, but dropping one is up to the highest named of them, so it isn't ours to plan
+print(f'Pending after gossip: {plan.pending()}')
+assert plan.pending() == [(objects[2], 1)]
+
+# Expire what was heard before time 2, nothing should go
+assert world.expire(2) == 0
+
+# peers[0] goes away, objects[2] is now down to 0 and objects[1] is back to k
+world.forget_node(peers[0])
+print(f'Pending after losing a peer: {plan.pending()}')
+assert plan.pending() == [(objects[2], 0), (objects[0], k - 1)]
+
+# Everything goes stale
+remaining = len(world)
+assert world.expire(3) == remaining
+assert len(world) == 0
+print(f'Pending after everything expired: {plan.pending()}')
+assert [count for _, count in plan.pending()] == [0, 0, 0]
+
+# Hearing from a node keeps everything it pins current without touching each record
+for obj in objects:
+    world.heard(obj, peers[1], 10)
+world.heard(objects[0], peers[2], 10)
+world.alive(peers[1], 20)
+assert world.expire(15) == 1 and not world.knows(peers[2])
+assert len(world) == len(objects) and world.knows(peers[1])
+
+# A node that stops pinning something drops just that record
+world.forget(objects[0], peers[1])
+print(f'Pending after a peer dropped a pin: {plan.pending()}')
+assert len(world) == len(objects) - 1 and world.get(objects[0]) is None
+
+# The highest named pin does plan drops, and nobody else plans adds
+plan.update(objects[1], True, k + 1, False, True)
+plan.update(objects[2], True, 1, False, True)
+assert (objects[1], k + 1) in plan.pending() and objects[2] not in dict(plan.pending())
+
+print('RESULTS')
+print('worldview and planner agree')
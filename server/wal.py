@@ -0,0 +1,191 @@
+#!/bin/usr/env python3
+
+# John Sullivan (jsulli28), Jozef Porubcin (jporubci)
+# wal.py
+
+import asyncio
+import os
+
+EXTENSION = 'log'
+
+# Write-ahead log with group commit.
+#
+# Records from any number of handlers are gathered into a batch and made durable together with a single write and
+# fsync, and each append returns only once the batch holding its record is on disk. While one batch is being
+# synced the next one fills up, so under load each fsync covers many records instead of one.
+#
+# A batch is written once it has max_batch records or has waited max_delay seconds, whichever comes first.
+#
+# The log is kept as numbered segments, {base}.{segment}.log. After checkpoint_records records, the committer
+# moves on to a new segment between batches and starts checkpoint(segment) (a coroutine function), which should
+# save the tables as they are at that moment. Batches keep being committed to the new segment while it runs, and
+# once it's done the segments before it are removed. A fresh segment is also started at every startup, so a
+# segment is never appended to after a crash.
+class WriteAheadLog:
+
+    def __init__(self, base, disk, max_batch, max_delay, checkpoint_records, checkpoint):
+        self.base = base
+        self.disk = disk # storage.Storage to write and sync with
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.checkpoint_records = checkpoint_records
+        self.checkpoint = checkpoint
+
+        self.segment = 0
+        self.file = None
+        self.records = 0 # records logged since the last checkpoint began
+        self.checkpoint_wanted = False
+
+        # records waiting to be written, and a future for each to say when it's durable
+        self.batch = []
+        self.waiters = []
+
+        # made in start, so they're bound to the running loop
+        self.pending = None # set when there's anything in the batch
+        self.full = None # set when the batch is full
+        self.task = None
+        self.checkpointing = None # checkpoint task, while one is running
+
+        # how well batching is going
+        self.commits = 0
+        self.committed = 0
+        self.checkpoints = 0
+
+    def location(self, segment):
+        return f'{self.base}.{segment}.{EXTENSION}'
+
+    # segment numbers on disk, oldest first
+    def segments(self):
+        directory, prefix = os.path.split(self.base)
+        found = []
+        for filename in os.listdir(directory or '.'):
+            parts = filename.split('.')
+            if len(parts) == 3 and parts[0] == prefix and parts[1].isdigit() and parts[2] == EXTENSION:
+                found.append(int(parts[1]))
+        return sorted(found)
+
+    # records in segments from start on, oldest first, for replaying at startup
+    # segments before start are already in the checkpoint, so they're removed
+    # also opens a new segment for appending
+    # a last line without its newline was cut short by a crash mid-write, so it was never acknowledged and is dropped
+    def replay(self, start=0):
+        segments = self.segments()
+
+        for segment in segments:
+            if segment < start:
+                os.remove(self.location(segment))
+                continue
+
+            with open(self.location(segment), 'rb') as file:
+                for line in file:
+                    if not line.endswith(b'\n'):
+                        print(f'error: wal: dropping a record cut short at the end of {self.location(segment)}')
+                        break
+                    line = line.decode().strip()
+                    if line:
+                        self.records += 1
+                        yield line
+
+        self.segment = max(segments + [start - 1]) + 1
+        self.file = open(self.location(self.segment), 'a')
+
+    # start committing, must be called from the running loop
+    def start(self):
+        self.pending = asyncio.Event()
+        self.full = asyncio.Event()
+        self.task = asyncio.ensure_future(self.committer())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+        if self.checkpointing is not None:
+            self.checkpointing.cancel()
+
+    # add a record, returning once it's on disk
+    # raises OSError if it couldn't be written
+    async def append(self, record):
+        waiter = asyncio.get_running_loop().create_future()
+        self.batch.append(record + '\n')
+        self.waiters.append(waiter)
+
+        self.pending.set()
+        if len(self.batch) >= self.max_batch:
+            self.full.set()
+
+        await waiter
+
+    # have the committer checkpoint after its next batch, even if it isn't due
+    def request_checkpoint(self):
+        self.checkpoint_wanted = True
+        self.pending.set()
+
+    async def committer(self):
+        while True:
+            await self.pending.wait()
+
+            # give the batch a moment to fill, unless it already has
+            if len(self.batch) < self.max_batch and self.max_delay > 0:
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch, self.batch = self.batch[:self.max_batch], self.batch[self.max_batch:]
+            waiters, self.waiters = self.waiters[:self.max_batch], self.waiters[self.max_batch:]
+            if not self.batch:
+                self.pending.clear()
+            if len(self.batch) < self.max_batch:
+                self.full.clear()
+
+            if batch:
+                try:
+                    await self.disk.run(write_sync, self.file, ''.join(batch))
+                    self.records += len(batch)
+                    self.commits += 1
+                    self.committed += len(batch)
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_result(None)
+                except OSError as os_err:
+                    print(f'error: wal: could not write {len(batch)} records: {os_err}')
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(os_err)
+
+            if self.checkpointing is None and (self.checkpoint_wanted or self.records >= self.checkpoint_records):
+                try:
+                    await self.rotate()
+                    self.checkpointing = asyncio.ensure_future(self.run_checkpoint(self.segment))
+                except OSError as os_err:
+                    print(f'error: wal: could not start a new segment: {os_err}')
+                self.checkpoint_wanted = False # try again when it's next due
+
+    # move on to a new segment, only called by the committer between batches
+    async def rotate(self):
+        file = await self.disk.open(self.location(self.segment + 1), 'a')
+        old_file, self.file = self.file, file
+        self.segment += 1
+        self.records = 0
+        await self.disk.close(old_file)
+
+    # checkpoint as of the start of segment, then remove the segments it covers
+    async def run_checkpoint(self, segment):
+        try:
+            await self.checkpoint(segment)
+            await self.disk.run(self.remove_before, segment)
+            self.checkpoints += 1
+        except OSError as os_err:
+            print(f'error: wal: checkpoint failed, keeping the log: {os_err}')
+        finally:
+            self.checkpointing = None
+
+    # remove segments before segment, for the disk pool
+    def remove_before(self, segment):
+        for old in self.segments():
+            if old < segment:
+                os.remove(self.location(old))
+
+def write_sync(file, data):
+    file.write(data)
+    file.flush()
+    os.fsync(file.fileno())
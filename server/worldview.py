@@ -0,0 +1,102 @@
+#!/bin/usr/env python3
+
+# John Sullivan (jsulli28), Jozef Porubcin (jporubci)
+# worldview.py
+
+import collections
+
+# Which nodes are known to pin which objects, and when we last heard from each node.
+#
+# Records are keyed by (object, node), so hearing the same thing again is an upsert rather than another entry, and
+# memory stays bounded by the number of distinct (object, node) pairs.
+#
+# Gossip from a node says what changed since last time, so records are added and dropped as it says, and what
+# keeps them from going stale is hearing from the node at all. Nodes are kept in an OrderedDict in the order they
+# were last heard from, so a heartbeat is one update however much the node pins, and expiring stale records only
+# has to look at the stale end for nodes that have gone quiet.
+#
+# If given, on_change(obj) is called whenever the set of nodes known to pin obj changes.
+class WorldView:
+
+    def __init__(self, on_change=None):
+
+        self.on_change = on_change
+
+        # UUID:HASH -> {node uuid: when first heard}
+        self.objects = {}
+
+        # node uuid -> set of UUID:HASH, for forgetting a node that's gone away
+        self.nodes = collections.defaultdict(set)
+
+        # node uuid -> lastheardfrom, oldest first
+        self.last_heard = collections.OrderedDict()
+
+        self.records = 0
+
+    def __len__(self):
+        return self.records
+
+    def __contains__(self, obj):
+        return obj in self.objects
+
+    # {node uuid: when first heard} for an object, or None if nobody is known to have it
+    def get(self, obj):
+        return self.objects.get(obj)
+
+    def items(self):
+        return self.objects.items()
+
+    # whether node has been heard from and not forgotten since, so its records are current
+    def knows(self, node):
+        return node in self.last_heard
+
+    # record that node pins obj as of when
+    def heard(self, obj, node, when):
+        known = self.objects.setdefault(obj, {})
+        if node not in known:
+            known[node] = when
+            self.nodes[node].add(obj)
+            self.records += 1
+            if self.on_change:
+                self.on_change(obj)
+
+        self.alive(node, when)
+
+    # record that node was heard from as of when, keeping everything it pins current
+    def alive(self, node, when):
+        self.last_heard[node] = when
+        self.last_heard.move_to_end(node)
+
+    # drop a single record
+    def forget(self, obj, node):
+        known = self.objects.get(obj)
+        if known is not None and node in known:
+            del known[node]
+            self.records -= 1
+            if not known:
+                del self.objects[obj]
+            if self.on_change:
+                self.on_change(obj)
+
+        held = self.nodes.get(node)
+        if held is not None:
+            held.discard(obj)
+            if not held:
+                del self.nodes[node]
+
+    # drop every record for a node, and that it was heard from
+    def forget_node(self, node):
+        for obj in list(self.nodes.get(node, ())):
+            self.forget(obj, node)
+        self.last_heard.pop(node, None)
+
+    # drop records of nodes last heard from before cutoff, returning how many were dropped
+    def expire(self, cutoff):
+        expired = 0
+        while self.last_heard:
+            node, when = next(iter(self.last_heard.items()))
+            if when >= cutoff:
+                break
+            expired += len(self.nodes.get(node, ()))
+            self.forget_node(node)
+        return expired
@@ -35,6 +35,8 @@ def test_performance():
         client.sPinDEL(id)
     del_duration = time.perf_counter_ns() - del_start
 
+    client.close()
+
     return {
         'ops': len(all_files),
         'add_ns': add_duration,
@@ -42,6 +44,33 @@ def test_performance():
         'del_ns': del_duration
     }
 
+# time repeated gets of small objects, the ones peers keep in memory
+def test_tiny_gets(rounds=10):
+
+    # set up client
+    client = sPinClient.sPinClient(verbose=False)
+
+    # add every file in the tiny directory once
+    tiny_files = [f'tiny/{file}' for file in os.listdir('tiny/')]
+    tiny_ids = [client.sPinADD(file) for file in tiny_files]
+
+    # get each of them over and over, so after the first round they should come from memory
+    get_start = time.perf_counter_ns()
+    for _ in range(rounds):
+        for id in tiny_ids:
+            client.sPinGET(id, f'results/{id}')
+    get_duration = time.perf_counter_ns() - get_start
+
+    for id in tiny_ids:
+        client.sPinDEL(id)
+
+    client.close()
+
+    return {
+        'ops': len(tiny_ids) * rounds,
+        'get_ns': get_duration
+    }
+
 if __name__ == '__main__':
 
     # run with 1 and 3 clients
@@ -87,3 +116,33 @@ if __name__ == '__main__':
         print(f'DEL Latency: {del_ltcy} s/op')
 
         print()
+
+    # make small files if there aren't any, a few kilobytes each
+    if not os.path.isdir('tiny/'):
+        os.makedirs('tiny/')
+        for i in range(100):
+            with open(f'tiny/{i}', 'wb') as file:
+                file.write(os.urandom(4096))
+
+    for n in [1, 3]:
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n) as executor:
+            futures = [executor.submit(test_tiny_gets) for _ in range(n)]
+
+            ops, get_ns = 0, 0
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as err:
+                    print(f'exception: {err}')
+                    continue
+
+                ops += result['ops']
+                get_ns += result['get_ns']
+
+        print(f'Tiny Object Results for {n} Client(s):')
+        get_thru = ops / (get_ns * (1 / 10 ** 9))
+        print(f'Tiny GET Throughput: {get_thru} ops/s')
+        print(f'Tiny GET Latency: {1 / get_thru} s/op')
+
+        print()